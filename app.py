@@ -1,18 +1,54 @@
+import os
 import re
+import tempfile
 
-import pandas as pd
 import plotly.express as px
 import streamlit as st
 import streamlit_authenticator as stauth
 import yaml
-from sqlalchemy import create_engine
-from st_aggrid import AgGrid
+from st_aggrid import AgGrid, GridUpdateMode
 from st_aggrid.grid_options_builder import GridOptionsBuilder
 
+from backend.database import engine
+from backend.export import available_formats, export
+from backend.migrations import is_up_to_date
+from backend.report_cache import ReportCache
+from backend.search import HIGHLIGHT, search_reports, search_snippets
+
+# テーブルの設定
+TABLE_COLUMNS = [
+    "report_date",
+    "firm_name",
+    "country",
+    "industry",
+    "issuer",
+    "type_of_audit_and_related_area_affected",
+    "description_of_the_deficiencies_identified",
+    "file_name_issuer",  # 選択した行の詳細表示用（非表示）
+]
+SORT_COLUMNS = {
+    "Report date": "report_date",
+    "Firm name": "firm_name",
+    "Country": "country",
+    "Industry": "industry",
+    "Issuer": "issuer",
+}
+PAGE_SIZES = [10, 25, 50, 100]
+TREND_PERIODS = {"Month": "M", "Quarter": "Q"}
+TRUNCATE_LENGTH = 300  # テーブルに表示する文章の長さ（選択すると全文を表示）
+# 検索結果のキャッシュ（取り込み中はdata_versionが変わるたびに増えるので上限を設ける）
+SEARCH_CACHE_ENTRIES = 32
+SEARCH_CACHE_TTL = 60 * 60  # 秒
+MARKDOWN_SPECIAL = re.compile(r"([\\`*_{}\[\]()#+\-.!|$<>~])")  # エスケープする文字
+
 
 def main():
-    # ソースデータ取り込み
-    df = get_df()
+    # 古いfir.dbのままなら読み込まずに止める
+    check_schema()
+
+    # ソースデータ取り込み（絞り込み用インデックスも作る）
+    index, rollup, data_version = get_filter_index()
+    df = index.df
 
     # サイドバー
     st.sidebar.title("Firm Inspectoin Reports Watcher :dog:")
@@ -21,34 +57,30 @@ def main():
     st.sidebar.markdown(f"## Login User : {name}")
     authenticator.logout("Logout", "sidebar")
 
-    # CSVダウンロード
+    # ダウンロード（中身は絞り込んだ後で作る）
     st.sidebar.markdown("## Download")
-    csv = make_csv(df)
-    st.sidebar.download_button(
-        label="Download CSV file",
-        data=csv,
-        file_name="firm_inspection_reports.csv",
-        mime="text/csv",
-        help="You can download the original data in CSV.",
-    )
+    download = st.sidebar.container()
 
     # セッティング
     st.sidebar.markdown("## Settings")
 
     # 選択肢作成
-    vars_firm_name, default_firm_name, vars_countries, vars_industries = make_vars(df)
+    vars_firm_name, default_firm_name, vars_countries, vars_industries = make_vars(
+        index
+    )
 
     # 検索フォーム
     input_word = st.sidebar.text_input(
         label="Search text",
         help='Search from "Type of audit and related area affected"'
-        + ' and "Description of the deficiencies identified".',
+        + ' and "Description of the deficiencies identified".'
+        + ' Supports "phrase", prefix*, AND / OR / NOT.',
         value="",
         placeholder="Enter keywords",
     )
 
     # レポート範囲選択
-    min_value, max_value = make_min_max_date(df)
+    min_value, max_value = make_min_max_date(index)
     start_date, end_date = st.sidebar.slider(
         "Report date",
         min_value=min_value,
@@ -85,37 +117,88 @@ def main():
 
     # グラフ用df
     df = filter_df(
-        df,
+        index,
         firm_name_multi_selected,
         countries_multi_selected,
         industries_multi_selected,
         start_date,
         end_date,
-        input_word,
     )
 
+    # 全文検索（FTS5、関連度順に並べ替え）
+    if input_word.strip():
+        df = df.merge(
+            search_df(input_word, data_version), on="file_name_issuer"
+        ).sort_values("rank")
+
+    # 絞り込んだ行のダウンロード
+    make_download(download, df)
+
+    # グラフ用の件数（集計テーブルを同じ条件で絞り込む。検索中は検索結果から数える）
+    if input_word.strip():
+        counts = df.assign(issuers=1)
+    else:
+        counts = filter_df(
+            rollup,
+            firm_name_multi_selected,
+            countries_multi_selected,
+            industries_multi_selected,
+            start_date,
+            end_date,
+        )
+
     # 棒グラフ
-    # bar = make_bar(df, "report_date", "Issuer", "report_date", "issuer")
+    trend_by = st.radio("Trend by", list(TREND_PERIODS), horizontal=True)
+    bar = make_bar(counts, trend_by)
 
     # 円グラフ
-    pie_firm = make_pie(df, "firm_name", "Firm name")
-    pie_country = make_pie(df, "country", "Country")
-    pie_industry = make_pie(df, "industry", "Industry")
+    pie_firm = make_pie(counts, "firm_name", "Firm name")
+    pie_country = make_pie(counts, "country", "Country")
+    pie_industry = make_pie(counts, "industry", "Industry")
 
     # 棒グラフと円グラフの配置
-    # st.plotly_chart(bar, use_container_width=True)
+    st.plotly_chart(bar, use_container_width=True)
     col1, col2, col3 = st.columns(3)
     col1.plotly_chart(pie_firm, use_container_width=True)
     col2.plotly_chart(pie_country, use_container_width=True)
     col3.plotly_chart(pie_industry, use_container_width=True)
 
-    # テーブル
-    df_table = make_table(df)
-    grid_options = set_aggrid_configure(df_table)
-    AgGrid(
-        df_table, gridOptions=grid_options, fit_columns_on_grid_load=True, height=750
+    # テーブル（表示するページだけをAgGridに渡す）
+    st.markdown(f"{len(df):,} rows")
+    col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
+    sort_options = (["Relevance"] if "rank" in df.columns else []) + list(SORT_COLUMNS)
+    sort_by = col1.selectbox("Sort by", sort_options)
+    ascending = col2.checkbox(
+        "Ascending",
+        value=sort_by not in ["Relevance", "Report date"],
+        key=f"ascending-{sort_by}",
+    )
+    page_size = col3.selectbox("Rows per page", PAGE_SIZES)
+    pages = max(1, -(-len(df) // page_size))
+    page = col4.number_input(
+        "Page",
+        min_value=1,
+        max_value=pages,
+        value=1,
+        step=1,
+        key=f"page-{len(df)}-{page_size}",  # 絞り込みが変わったら1ページ目に戻す
+    )
+
+    df_page = make_page(df, sort_by, ascending, page, page_size)
+    grid_options = set_aggrid_configure(df_page)
+    grid = AgGrid(
+        df_page,
+        gridOptions=grid_options,
+        fit_columns_on_grid_load=True,
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        reload_data=True,  # keyが固定なので、ページ・並べ替え・絞り込みの変更は読み込み直す
+        key="reports",
     )
 
+    # 選択した行は省略せずに表示
+    if grid["selected_rows"]:
+        show_detail(index.df, grid["selected_rows"][0]["file_name_issuer"], input_word)
+
 
 def load_config():
     """ログイン情報読み込み"""
@@ -135,151 +218,100 @@ def load_config():
 
 @st.cache_resource
 def get_db_engin():
-    """DB接続"""
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./backend/fir.db"
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-
+    """DB接続（取り込み側と同じ設定のエンジン。WALなので取り込み中も読める）"""
     return engine
 
 
-@st.cache_data
-def get_df():
-    """最初のdf取り込み"""
-    engine = get_db_engin()
-    links = pd.read_sql(sql="SELECT * FROM links ORDER BY report_date DESC", con=engine)
-    reports = pd.read_sql(sql="SELECT * FROM reports", con=engine)
-    df = pd.merge(reports, links, on="file_name", how="left")
-    df["report_date"] = pd.to_datetime(df["report_date"])
-    df["search_text"] = (
-        df["type_of_audit_and_related_area_affected"]
-        + df["description_of_the_deficiencies_identified"]
-    )
-    # 並べ替え
-    df = df.sort_values(
-        ["report_date", "firm_name", "issuer"], ascending=[False, True, True]
-    )
-
-    # expandedがある場合は、そっちを残して古い方を消す
-    expanded = df[df.pdf_url.str.contains("-expanded.pdf")]
-    for expanded_url in set(expanded["pdf_url"]):
-        base_num = re.search(r"\d{3}-\d{4}-\d{3}", expanded_url).group()
-        # -> 104-2021-175
-
-        # base_numを含む、かつ、'-expanded'を含まない方を消す
-        drop_index = df.index[
-            df["pdf_url"].str.contains(base_num)
-            & ~df.pdf_url.str.contains("-expanded.pdf")
-        ]
-        df.drop(drop_index, inplace=True)
-
-    # xxx-xxxx-xxxaの末尾のaがある場合は、そっちを残して古い方を消す
-    a = df[df.pdf_url.str.match(r".*\d{3}-\d{4}-\d{3}a.*")]
-    for a_url in set(a["pdf_url"]):
-        base_num = re.search(r"\d{3}-\d{4}-\d{3}", a_url).group()
-        # -> 104-2021-175
-
-        # base_numを含む、かつ、'a'を含まない方を消す
-        drop_index = df.index[
-            df["pdf_url"].str.contains(base_num)
-            & ~df.pdf_url.str.match(r".*\d{3}-\d{4}-\d{3}a.*")
-        ]
-        df.drop(drop_index, inplace=True)
-
-    return df
-
-
-@st.cache_data
-def make_csv(df):
-    """ダウンロード用CSVの作成"""
-    df_download = df[
-        [
-            "report_date",
-            "firm_name",
-            "country",
-            "industry",
-            "issuer",
-            "type_of_audit_and_related_area_affected",
-            "description_of_the_deficiencies_identified",
-            "pdf_url",
-        ]
-    ]
-    csv = df_download.to_csv(index=False)
-
-    return csv
-
-
-@st.cache_data
-def make_vars(df):
-    """選択肢作成"""
-    # ファーム選択用
-    vars_firm_name = list(set([var for var in df["firm_name"]]))
-    vars_firm_name = sorted(vars_firm_name)
-
-    default_firm_name = list(
-        set(
-            [
-                var
-                for var in df["firm_name"]
-                if re.search(
-                    r"^(?=.*deloitte).*$|^(?=.*kpmg).*$|^(?=.*ernst).*$"
-                    + r"|^(?=.*pricewaterhousecoopers).*$",
-                    var,
-                    flags=re.IGNORECASE,
-                )
-            ]
+def check_schema():
+    """DBのスキーマが最新か確認（マイグレーションは書き込みなので取り込み側で行う）"""
+    if not is_up_to_date(get_db_engin()):
+        st.error(
+            "The database schema is out of date."
+            + " Run `python -m backend.migrations` (or an ingest command) first."
         )
-    )
-    default_firm_name = sorted(default_firm_name)
+        st.stop()
 
-    # 国名選択用
-    vars_countries = list(set([var for var in df["country"]]))
-    vars_countries = sorted(vars_countries)
 
-    # 産業選択
-    vars_industries = list(set([var for var in df["industry"]]))
-    vars_industries = sorted(vars_industries)
+@st.cache_resource
+def get_report_cache():
+    """取り込んだデータのキャッシュ（全セッションで共有）"""
+    return ReportCache(get_db_engin())
+
+
+def get_filter_index():
+    """絞り込み用インデックスとグラフ用の集計（取り込みがあれば追加分だけ読み込む）"""
+    # data_versionを確認するだけなら1クエリ。ロックの中で取った組だけを使う
+    index, rollup, version = get_report_cache().refresh()
+
+    return index, rollup, version
+
+
+def make_download(container, df):
+    """ダウンロード（ボタンを押したときだけ、絞り込んだ行をファイルに書き出す）"""
+    formats = available_formats()
+    label = container.selectbox("Format", list(formats))
+    export_format = formats[label]
+    if not container.button(
+        f"Prepare download ({len(df):,} rows)",
+        help="Export the rows matching the current filters.",
+    ):
+        return
+
+    file_name = "firm_inspection_reports." + export_format.extension
+    with tempfile.TemporaryDirectory() as tmp_dir, st.spinner("Exporting..."):
+        path = os.path.join(tmp_dir, file_name)
+        export(df, export_format, path)
+        with open(path, "rb") as f:
+            container.download_button(
+                label=f"Download {label}",
+                data=f,
+                file_name=file_name,
+                mime=export_format.mime,
+            )
+
+
+def make_vars(index):
+    """選択肢作成（絞り込み用インデックスから）"""
+    vars_firm_name = index.vars("firm_name")
+    default_firm_name = index.default_firms()  # Big4
+    vars_countries = index.vars("country")
+    vars_industries = index.vars("industry")
 
     return vars_firm_name, default_firm_name, vars_countries, vars_industries
 
 
-@st.cache_data
-def make_min_max_date(df):
+def make_min_max_date(index):
     """report_dateの最小値と最大値"""
-    min_value = df["report_date"].min().to_pydatetime()
-    max_value = df["report_date"].max().to_pydatetime()
-
-    return min_value, max_value
+    return index.date_range()
 
 
-@st.cache_data
 def filter_df(
-    df,
+    index,
     firm_name_multi_selected,
     countries_multi_selected,
     industries_multi_selected,
     start_date,
     end_date,
-    input_word,
 ):
-    """dfにフィルターかける"""
-    df = df[
-        (df["firm_name"].isin(firm_name_multi_selected))
-        & (df["country"].isin(countries_multi_selected))
-        & (df["industry"].isin(industries_multi_selected))
-        & (df["report_date"] >= start_date)
-        & (df["report_date"] <= end_date)
-        & (df["search_text"].str.contains(input_word))
-    ]
-
-    return df
-
-
-@st.cache_data
-def make_pie(df, column, title):
-    """円グラフ作成"""
-    df = df[column].value_counts(sort=True)
+    """dfにフィルターかける（インデックスの整数配列の操作だけで絞り込む）"""
+    selected = {
+        "firm_name": firm_name_multi_selected,
+        "country": countries_multi_selected,
+        "industry": industries_multi_selected,
+    }
+
+    return index.filter(selected, start_date, end_date)
+
+
+@st.cache_data(max_entries=SEARCH_CACHE_ENTRIES, ttl=SEARCH_CACHE_TTL)
+def search_df(input_word, data_version):
+    """全文検索（関連度の順位、data_versionごとにキャッシュ）"""
+    return search_reports(get_db_engin(), input_word)
+
+
+def make_pie(counts, column, title):
+    """円グラフ作成（issuersの合計）"""
+    df = counts.groupby(column)["issuers"].sum().sort_values(ascending=False)
     df = df.rename_axis(column).reset_index(name="counts")
     pie = px.pie(df, title=title, values="counts", names=column)
     pie.update_traces(
@@ -292,44 +324,101 @@ def make_pie(df, column, title):
     return pie
 
 
-# @st.cache_data
-# def make_bar(df, column, title, x, y):
-#     """棒グラフ作成"""
-#     df_bar = df.groupby(column, as_index=False).count()
-#     bar = px.bar(df_bar, title=title, x=x, y=y)
+def make_bar(counts, trend_by):
+    """棒グラフ作成（月・四半期ごとのissuersの合計）"""
+    period = counts["report_date"].dt.to_period(TREND_PERIODS[trend_by])
+    df_bar = counts.groupby(period)["issuers"].sum().reset_index()
+    df_bar["report_date"] = df_bar["report_date"].astype(str)
+    bar = px.bar(
+        df_bar,
+        title="Issuers with deficiencies",
+        x="report_date",
+        y="issuers",
+        labels={"report_date": trend_by, "issuers": "Issuers"},
+    )
+
+    return bar
+
+
+def make_page(df, sort_by, ascending, page, page_size):
+    """表示するページのテーブル作成（並べ替えてから切り出し、長い文章は省略）"""
+    if sort_by == "Relevance":
+        # 検索結果は関連度の高い順に並んでいる
+        df = df.iloc[::-1] if ascending else df
+    elif sort_by != "Report date" or ascending or "rank" in df.columns:
+        # 並べ替え前は新しい順（report_dateの降順）。検索中は関連度順なので並べ替える
+        df = df.sort_values(SORT_COLUMNS[sort_by], ascending=ascending, kind="stable")
+
+    start = (page - 1) * page_size
+    end = start + page_size
+    df = df.iloc[start:end]
+
+    df_table = df[TABLE_COLUMNS]
+
+    return df_table.assign(
+        **{
+            column: df_table[column].map(truncate)
+            for column in [
+                "type_of_audit_and_related_area_affected",
+                "description_of_the_deficiencies_identified",
+            ]
+        }
+    )
+
+
+def truncate(text):
+    """長い文章を省略"""
+    if not isinstance(text, str) or len(text) <= TRUNCATE_LENGTH:
+        return text
+
+    return text[:TRUNCATE_LENGTH].rsplit(" ", 1)[0] + " …"
 
-#     return bar
 
+def highlight(snippet):
+    """スニペットをMarkdownに変換（一致した語を太字にする）"""
+    text = MARKDOWN_SPECIAL.sub(r"\\\1", snippet)
+
+    return text.replace(HIGHLIGHT[0], "**").replace(HIGHLIGHT[1], "**")
+
+
+def show_detail(df, file_name_issuer, input_word):
+    """選択した行の詳細（検索中は一致した語を強調したスニペットも表示）"""
+    row = df[df["file_name_issuer"] == file_name_issuer]
+    if row.empty:
+        return
+    row = row.iloc[0]
+
+    st.markdown(f"### {row['issuer']}")
+    st.caption(
+        f"{str(row['report_date'])[:10]} / {row['firm_name']} / {row['country']}"
+        + f" / {row['industry']} / [PDF]({row['pdf_url']})"
+    )
 
-@st.cache_data
-def make_table(df):
-    """テーブル作成"""
-    df_table = df[
-        [
-            "report_date",
-            "firm_name",
-            "country",
-            "industry",
-            "issuer",
-            "type_of_audit_and_related_area_affected",
-            "description_of_the_deficiencies_identified",
-        ]
-    ]
+    if input_word.strip():
+        snippets = search_snippets(get_db_engin(), input_word, file_name_issuer)
+        matches = [s for s in snippets.values() if HIGHLIGHT[0] in s]
+        if matches:
+            st.markdown("**Matches**")
+        for snippet in matches:
+            st.markdown(highlight(snippet))
 
-    return df_table
+    st.markdown("**Type of audit and related area affected**")
+    st.text(row["type_of_audit_and_related_area_affected"])
+    st.markdown("**Description of the deficiencies identified**")
+    st.text(row["description_of_the_deficiencies_identified"])
 
 
-@st.cache_data
 def set_aggrid_configure(df):
-    """aggridのオプション設定"""
+    """aggridのオプション設定（並べ替えとページ分けはPython側で行う）"""
     gb = GridOptionsBuilder.from_dataframe(df)
-    gb.configure_default_column(wrapText=True, autoHeight=True)
-    gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=10)
+    gb.configure_default_column(wrapText=True, autoHeight=True, sortable=False)
+    gb.configure_selection("single")
     gb.configure_column(
         "report_date", type=["customDateTimeFormat"], custom_format_string="yyyy-MM-dd"
     )
     gb.configure_column("type_of_audit_and_related_area_affected", width=350)
     gb.configure_column("description_of_the_deficiencies_identified", width=700)
+    gb.configure_column("file_name_issuer", hide=True)
     grid_options = gb.build()
 
     return grid_options
@@ -1,11 +1,51 @@
-from sqlalchemy import create_engine
+import os
+from typing import Any
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///fir.db"
+# 実行ディレクトリに関係なくbackend/fir.dbを使う（FIR_DATABASE_URLで変更できる）
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fir.db")
+DATABASE_URL_ENV = "FIR_DATABASE_URL"
+SQLALCHEMY_DATABASE_URL = os.environ.get(DATABASE_URL_ENV) or "sqlite:///" + DB_PATH
+
+# 接続ごとに設定するSQLiteのPRAGMA
+# WALにすると、取り込み（書き込み）中もダッシュボードから読める
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # WALならNORMALでもDBは壊れない（電源断で直近の更新が消えるだけ）
+    "cache_size": -64 * 1024,  # 64MB（負の値はKB単位）
+    "temp_store": "MEMORY",
+    "busy_timeout": 30 * 1000,  # 書き込みロックを最大30秒待つ（database is lockedを避ける）
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    """接続時にPRAGMAを設定"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def make_engine(url: str = SQLALCHEMY_DATABASE_URL) -> Engine:
+    """エンジンを作成（SQLiteはスレッドをまたいで使えるようにし、PRAGMAを設定する）
+    Args:
+        url(str): DBのURL
+    Returns:
+        engine(Engine): SQLAlchemyのエンジン
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
+    return engine
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -0,0 +1,131 @@
+"""ダッシュボードのダウンロード用のファイル作成
+
+絞り込み後のdfをCHUNK_ROWS行ずつファイルに書き出す（全体の文字列をメモリに作らない）。
+csv.gzは標準ライブラリだけで作れる。Parquet / XLSXはpyarrow / XlsxWriterがあれば選べる。
+"""
+import gzip
+import io
+from typing import BinaryIO, Callable, Dict, Iterator, NamedTuple
+
+import pandas as pd
+
+# Parquet（pyarrowがあれば使える）
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# XLSX（XlsxWriterがあれば使える）
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+EXPORT_COLUMNS = [
+    "report_date",
+    "firm_name",
+    "country",
+    "industry",
+    "issuer",
+    "type_of_audit_and_related_area_affected",
+    "description_of_the_deficiencies_identified",
+    "pdf_url",
+]
+CHUNK_ROWS = 5000
+XLSX_MAX_CHARS = 32767  # Excelの1セルの文字数の上限
+
+
+class ExportFormat(NamedTuple):
+    """ダウンロードの形式"""
+
+    extension: str
+    mime: str
+    write: Callable[[pd.DataFrame, BinaryIO], None]
+
+
+def _chunks(df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+    """CHUNK_ROWS行ずつ（出力する列だけ）"""
+    for start in range(0, len(df), CHUNK_ROWS):
+        end = start + CHUNK_ROWS
+        chunk = df.iloc[start:end][EXPORT_COLUMNS]
+        yield chunk.assign(report_date=chunk["report_date"].dt.strftime("%Y-%m-%d"))
+
+
+def write_csv_gz(df: pd.DataFrame, f: BinaryIO) -> None:
+    """gzip圧縮したCSV"""
+    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        # 行が無くてもヘッダーは書く
+        pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(text, index=False)
+        for chunk in _chunks(df):
+            chunk.to_csv(text, index=False, header=False)
+        text.flush()
+        text.detach()
+
+
+def write_parquet(df: pd.DataFrame, f: BinaryIO) -> None:
+    """Parquet（チャンクごとに1つのrow group）"""
+    schema = pa.schema([(column, pa.string()) for column in EXPORT_COLUMNS])
+    with pq.ParquetWriter(f, schema, compression="zstd") as writer:
+        for chunk in _chunks(df):
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+
+
+def write_xlsx(df: pd.DataFrame, f: BinaryIO) -> None:
+    """XLSX（constant_memoryで1行ずつ書き出す）"""
+    workbook = xlsxwriter.Workbook(
+        f, {"constant_memory": True, "strings_to_urls": False}
+    )
+    worksheet = workbook.add_worksheet("reports")
+    worksheet.write_row(0, 0, EXPORT_COLUMNS, workbook.add_format({"bold": True}))
+    row = 1
+    for chunk in _chunks(df):
+        for values in chunk.itertuples(index=False):
+            worksheet.write_row(
+                row,
+                0,
+                [
+                    value[:XLSX_MAX_CHARS] if isinstance(value, str) else ""
+                    for value in values
+                ],
+            )
+            row += 1
+    workbook.close()
+
+
+def available_formats() -> Dict[str, ExportFormat]:
+    """使える形式（表示名 -> 形式）"""
+    formats = {
+        "CSV (gzip)": ExportFormat("csv.gz", "application/gzip", write_csv_gz),
+    }
+    if pa is not None:
+        formats["Parquet"] = ExportFormat(
+            "parquet", "application/vnd.apache.parquet", write_parquet
+        )
+    if xlsxwriter is not None:
+        formats["Excel (XLSX)"] = ExportFormat(
+            "xlsx",
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            write_xlsx,
+        )
+
+    return formats
+
+
+def export(df: pd.DataFrame, export_format: ExportFormat, path: str) -> int:
+    """ファイルに書き出す
+    Args:
+        df(pd.DataFrame): 絞り込み後のdf
+        export_format(ExportFormat): 形式
+        path(str): 書き出すパス
+    Returns:
+        size(int): ファイルのバイト数
+    """
+    with open(path, "wb") as f:
+        export_format.write(df, f)
+        size = f.tell()
+
+    return size
@@ -0,0 +1,143 @@
+"""ダッシュボードの絞り込み用インデックス
+
+データの読み込みごとに1回だけ作り、ウィジェットが変わるたびの絞り込みは
+整数の配列の操作だけで済ませる。
+
+- firm_name / country / industry: 行ごとのカテゴリのコードと、値ごとの行位置の配列
+- report_date: 並べ替えた日付の配列（二分探索で範囲を切り出す）
+"""
+import datetime
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ["firm_name", "country", "industry"]
+DATE_COLUMN = "report_date"
+
+# Big4（ファーム選択の初期値）
+DEFAULT_FIRMS = re.compile(
+    r"deloitte|kpmg|ernst|pricewaterhousecoopers", flags=re.IGNORECASE
+)
+
+
+class FilterIndex:
+    """絞り込み用インデックス（絞り込み後もdfの行の順番はそのまま）"""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df.reset_index(drop=True)
+        self.codes: Dict[str, np.ndarray] = {}
+        self.options: Dict[str, pd.Index] = {}
+        self.positions: Dict[str, List[np.ndarray]] = {}
+
+        for column in CATEGORY_COLUMNS:
+            # 値なしは-1（どの選択肢にも一致しない）
+            codes, uniques = pd.factorize(self.df[column], sort=True)
+            self.codes[column] = codes
+            self.options[column] = pd.Index(uniques)
+            self.positions[column] = self._group_positions(codes, len(uniques))
+
+        self.dates = self.df[DATE_COLUMN].to_numpy(dtype="datetime64[ns]")
+        self.date_order = np.argsort(self.dates, kind="stable")  # NaTは末尾
+        self.sorted_dates = self.dates[self.date_order]
+
+    @staticmethod
+    def _group_positions(codes: np.ndarray, size: int) -> List[np.ndarray]:
+        """値ごとの行位置（昇順）"""
+        if size == 0:
+            return []
+        # コード順に並べ替えて値ごとに分割（先頭の値なし(-1)は除く）
+        missing = np.count_nonzero(codes < 0)
+        order = np.argsort(codes, kind="stable")[missing:]
+        counts = np.bincount(codes[codes >= 0], minlength=size)
+
+        return np.split(order, np.cumsum(counts)[:-1])
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def vars(self, column: str) -> List[str]:
+        """選択肢（昇順）"""
+        return list(self.options[column])
+
+    def default_firms(self) -> List[str]:
+        """ファーム選択の初期値（Big4）"""
+        return [
+            name for name in self.options["firm_name"] if DEFAULT_FIRMS.search(name)
+        ]
+
+    def date_range(self) -> Tuple[datetime.datetime, datetime.datetime]:
+        """report_dateの最小値と最大値"""
+        dates = self.sorted_dates[~np.isnat(self.sorted_dates)]
+
+        return (
+            pd.Timestamp(dates[0]).to_pydatetime(),
+            pd.Timestamp(dates[-1]).to_pydatetime(),
+        )
+
+    def _codes(self, column: str, values: Sequence[str]) -> np.ndarray:
+        """選択された値のコード（存在しない値は除く）"""
+        codes = self.options[column].get_indexer(list(values))
+
+        return codes[codes >= 0]
+
+    def filter_positions(
+        self,
+        selected: Dict[str, Sequence[str]],
+        start_date: datetime.datetime,
+        end_date: datetime.datetime,
+    ) -> np.ndarray:
+        """条件に一致する行位置
+        Args:
+            selected(Dict[str, Sequence[str]]): 列 -> 選択された値
+            start_date(datetime): report_dateの開始（以上）
+            end_date(datetime): report_dateの終了（以下）
+        Returns:
+            positions(np.ndarray): 一致した行位置（昇順）
+        """
+        start = np.datetime64(pd.Timestamp(start_date))
+        end = np.datetime64(pd.Timestamp(end_date))
+        lo = np.searchsorted(self.sorted_dates, start, "left")
+        hi = np.searchsorted(self.sorted_dates, end, "right")
+        candidates = self.date_order[lo:hi]
+
+        codes = {
+            column: self._codes(column, values) for column, values in selected.items()
+        }
+
+        # 日付の範囲より行数が少なければ、そのカテゴリの行位置から始める
+        first: Optional[str] = None
+        if codes:
+            sizes = {
+                column: sum(len(self.positions[column][code]) for code in column_codes)
+                for column, column_codes in codes.items()
+            }
+            first = min(sizes, key=sizes.__getitem__)
+            if sizes[first] < len(candidates):
+                candidates = np.concatenate(
+                    [np.empty(0, dtype=np.intp)]
+                    + [self.positions[first][code] for code in codes[first]]
+                )
+                dates = self.dates[candidates]
+                candidates = candidates[(dates >= start) & (dates <= end)]
+            else:
+                first = None
+
+        for column, column_codes in codes.items():
+            if column == first:
+                continue
+            allowed = np.zeros(len(self.options[column]) + 1, dtype=bool)
+            allowed[column_codes] = True  # allowed[-1]（値なし）は常にFalse
+            candidates = candidates[allowed[self.codes[column][candidates]]]
+
+        return np.sort(candidates)
+
+    def filter(
+        self,
+        selected: Dict[str, Sequence[str]],
+        start_date: datetime.datetime,
+        end_date: datetime.datetime,
+    ) -> pd.DataFrame:
+        """条件に一致する行（引数はfilter_positionsと同じ）"""
+        return self.df.iloc[self.filter_positions(selected, start_date, end_date)]
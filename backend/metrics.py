@@ -0,0 +1,391 @@
+"""クロール・ダウンロード・パース・DB書き込みの計測
+
+処理時間のヒストグラムとカウンタ（ページ数、バイト数、pdf数、Issuer数、リトライ、失敗）を
+プロセス内に集計し、実行の最後にJSONとPrometheusのtextfile形式で書き出す。
+パース用の子プロセスの計測値は drain で取り出して親プロセスで merge する。
+
+    with timer("extract_seconds"):
+        ...
+    inc("pdf_pages", doc.page_count)
+
+--profile を付けるとステージごとに cProfile の結果を {stage}.{pid}.prof に保存する。
+"""
+import argparse
+import cProfile
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+# 処理時間のヒストグラムの区切り（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Prometheusのメトリクス名の接頭辞
+PREFIX = "fir_"
+
+# 環境変数で指定した場合は子プロセスにも引き継がれる
+METRICS_DIR_ENV = "FIR_METRICS_DIR"
+PROFILE_ENV = "FIR_PROFILE"
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]  # (名前, ラベル)
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_value(value: float) -> str:
+    """整数ならそのまま、小数なら有効数字を落とさずに表示"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_key(key: Key) -> str:
+    """'download_bytes{host="pcaobus.org"}' の形"""
+    name, labels = key
+    if not labels:
+        return name
+
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """処理時間の分布（区切りごとの件数と合計）"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)  # 最後は+Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.count += other["count"]
+        self.sum += other["sum"]
+        self.max = max(self.max, other["max"])
+
+    def quantile(self, q: float) -> float:
+        """区切りから求めたおおよその分位点"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """計測値の集計（スレッドセーフ）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.started_at = datetime.datetime.now()
+        self.job = "fir"
+        self.metrics_dir: Optional[str] = os.environ.get(METRICS_DIR_ENV) or None
+        self.profile = bool(os.environ.get(PROFILE_ENV))
+        self._profiles: Dict[Tuple[str, int], cProfile.Profile] = {}
+
+    def reset(self) -> None:
+        """計測値とcProfileを破棄"""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self._profiles.clear()
+
+    def after_fork(self) -> None:
+        """forkした子プロセスで、親から引き継いだロックと計測値を作り直す"""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """カウンタを加算"""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        """処理時間を記録"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """withの中の処理時間を記録（例外でも記録する）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def drain(self) -> Dict[str, Any]:
+        """計測値を取り出してリセット（子プロセスから親プロセスへ渡す用）"""
+        with self._lock:
+            snapshot = {
+                "counters": [[list(k), v] for k, v in self.counters.items()],
+                "histograms": [
+                    [list(k), h.to_dict()] for k, h in self.histograms.items()
+                ],
+            }
+            self.counters.clear()
+            self.histograms.clear()
+
+        return snapshot
+
+    def merge(self, snapshot: Optional[Dict[str, Any]]) -> None:
+        """drainで取り出した計測値を合算"""
+        if not snapshot:
+            return
+
+        with self._lock:
+            for (name, labels), value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for (name, labels), data in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(data)
+
+    @contextmanager
+    def profiled(self, stage: str) -> Iterator[None]:
+        """--profile の場合だけwithの中をcProfileで計測（スレッドごとに集計）"""
+        if not self.profile:
+            yield
+            return
+
+        key = (stage, threading.get_ident())
+        with self._lock:
+            profile = self._profiles.setdefault(key, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def dump_profiles(self) -> List[str]:
+        """ステージごとのcProfileの結果を {stage}.{pid}.prof に保存"""
+        if not self._profiles or self.metrics_dir is None:
+            return []
+
+        stages: Dict[str, List[cProfile.Profile]] = {}
+        with self._lock:
+            for (stage, _), profile in self._profiles.items():
+                stages.setdefault(stage, []).append(profile)
+
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        paths = []
+        for stage, profiles in stages.items():
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            path = os.path.join(self.metrics_dir, f"{stage}.{os.getpid()}.prof")
+            stats.dump_stats(path)
+            paths.append(path)
+
+        return paths
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONで書き出す形"""
+        finished_at = datetime.datetime.now()
+        with self._lock:
+            counters = {_format_key(k): v for k, v in sorted(self.counters.items())}
+            histograms = {
+                _format_key(k): dict(
+                    h.to_dict(),
+                    buckets=list(BUCKETS),
+                    p50=h.quantile(0.5),
+                    p95=h.quantile(0.95),
+                )
+                for k, h in sorted(self.histograms.items())
+            }
+
+        return {
+            "job": self.job,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "duration_seconds": (finished_at - self.started_at).total_seconds(),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheusのtextfile形式"""
+        lines = []
+        job = (("job", self.job),)
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            name = PREFIX + name + "_total"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{_format_key((name, job + labels))} {_format_value(value)}")
+
+        for (name, labels), h in histograms:
+            name = PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), h.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                key = (name + "_bucket", job + labels + (("le", le),))
+                lines.append(f"{_format_key(key)} {cumulative}")
+            key = (name + "_sum", job + labels)
+            lines.append(f"{_format_key(key)} {_format_value(h.sum)}")
+            lines.append(f"{_format_key((name + '_count', job + labels))} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """実行の最後に表示するまとめ"""
+        lines = [f"--- metrics ({self.job}) ---"]
+        with self._lock:
+            for key, value in sorted(self.counters.items()):
+                lines.append(f"{_format_key(key):<48} {_format_value(value):>12}")
+            for key, h in sorted(self.histograms.items()):
+                lines.append(
+                    f"{_format_key(key):<48} n={h.count:<6} total={h.sum:.2f}s"
+                    + f" mean={h.sum / h.count:.3f}s p95={h.quantile(0.95):.3f}s"
+                    + f" max={h.max:.3f}s"
+                )
+
+        return "\n".join(lines)
+
+    def write(self) -> List[str]:
+        """metrics_dirにJSONとPrometheusのtextfileを書き出す"""
+        if self.metrics_dir is None:
+            return []
+
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        paths = []
+        for file_name, content in [
+            (f"{self.job}.json", json.dumps(self.to_dict(), indent=2)),
+            (f"{PREFIX}{self.job}.prom", self.to_prometheus()),
+        ]:
+            path = os.path.join(self.metrics_dir, file_name)
+            # node_exporterが書きかけを読まないように一時ファイルからリネーム
+            tmp_path = path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            paths.append(path)
+
+        return paths
+
+
+# プロセス共通の集計
+METRICS = Metrics()
+if hasattr(os, "register_at_fork"):
+    # forkした子プロセスに親の計測値が残ると、mergeで二重に数えてしまう
+    # （forkした時点で他のスレッドがロックを持っていることがあるので作り直す）
+    os.register_at_fork(after_in_child=METRICS.after_fork)
+inc = METRICS.inc
+observe = METRICS.observe
+timer = METRICS.timer
+profiled = METRICS.profiled
+
+
+def in_worker_process() -> bool:
+    """ProcessPoolExecutorの子プロセスで実行中か"""
+    return multiprocessing.parent_process() is not None
+
+
+def count_retry(name: str) -> Callable[[Any], None]:
+    """tenacityのbefore_sleepに渡して、リトライ回数と待ち時間を記録"""
+
+    def before_sleep(retry_state: Any) -> None:
+        inc("retries", stage=name)
+        inc("retry_sleep_seconds", retry_state.next_action.sleep, stage=name)
+
+    return before_sleep
+
+
+def profile_stage(stage: str) -> Callable[[F], F]:
+    """関数の実行をstageとしてcProfileで計測するデコレータ（--profileの場合だけ）"""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with METRICS.profiled(stage):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """計測の出力先の引数を追加"""
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.environ.get(METRICS_DIR_ENV),
+        help=f"計測結果（JSON / Prometheus textfile）の出力先（環境変数{METRICS_DIR_ENV}）",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="ステージごとのcProfileの結果をmetrics-dirに保存する",
+    )
+
+
+def start_run(job: str, metrics_dir: Optional[str], profile: bool = False) -> None:
+    """計測を開始（子プロセスにも設定を引き継ぐ）
+    Args:
+        job(str): 実行するスクリプトの名前（出力ファイル名とjobラベル）
+        metrics_dir(str): 出力先（Noneなら書き出さず、まとめの表示だけ）
+        profile(bool): cProfileの結果も保存する
+    """
+    METRICS.job = job
+    METRICS.started_at = datetime.datetime.now()
+    METRICS.metrics_dir = metrics_dir
+    METRICS.profile = profile and metrics_dir is not None
+    if metrics_dir is not None:
+        os.environ[METRICS_DIR_ENV] = metrics_dir
+    if METRICS.profile:
+        os.environ[PROFILE_ENV] = "1"
+
+
+def finish_run() -> None:
+    """まとめを表示して、JSON / Prometheus textfile / cProfileを書き出す"""
+    print(METRICS.summary())
+    for path in METRICS.write() + METRICS.dump_profiles():
+        print("metrics:", path)
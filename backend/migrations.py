@@ -0,0 +1,296 @@
+"""DBのマイグレーション
+
+テーブルが無ければ作成し（create_all）、既存のfir.dbには
+PRAGMA user_version より新しいマイグレーションだけを順番に適用する。
+
+python -m backend.migrations
+"""
+from typing import Any, Callable, List
+
+from sqlalchemy.engine import Connection
+
+from backend.database import Base, engine
+from backend.models import (  # noqa: F401  テーブルをBase.metadataに登録する
+    CrawlState,
+    DataVersion,
+    Download,
+    Link,
+    ParseLedger,
+    Report,
+    ReportRollup,
+    TextCache,
+)
+from backend.storage import refresh_rollup, report_revision
+
+Migration = Callable[[Connection], None]
+
+# 同じレポート番号の中で一番新しい版だけを残したreports（linksの列も付ける）
+CANONICAL_REPORTS = """
+CREATE VIEW IF NOT EXISTS canonical_reports AS
+SELECT
+    r.*,
+    l.firm_name,
+    l.country,
+    l.report_date,
+    l.pdf_url,
+    l.report_base,
+    l.revision_rank
+FROM reports AS r
+LEFT JOIN links AS l ON l.file_name = r.file_name
+WHERE l.report_base IS NULL
+    OR l.revision_rank = (
+        SELECT MAX(l2.revision_rank) FROM links AS l2
+        WHERE l2.report_base = l.report_base
+    )
+"""
+
+# reportsの全文検索用（単語単位、英語の語形変化はporterでそろえる）
+# reports_fts_rowid（file_name_issuer -> reports_ftsのrowid）で、トリガーはrowidで更新・削除する
+REPORTS_FTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+        type_of_audit_and_related_area_affected,
+        description_of_the_deficiencies_identified,
+        file_name_issuer UNINDEXED,
+        tokenize = 'porter unicode61'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reports_fts_rowid (
+        id INTEGER PRIMARY KEY,
+        file_name_issuer VARCHAR NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reports_fts_insert AFTER INSERT ON reports BEGIN
+        INSERT INTO reports_fts_rowid (file_name_issuer) VALUES (new.file_name_issuer);
+        INSERT INTO reports_fts (
+            rowid,
+            type_of_audit_and_related_area_affected,
+            description_of_the_deficiencies_identified,
+            file_name_issuer
+        ) VALUES (
+            (
+                SELECT id FROM reports_fts_rowid
+                WHERE file_name_issuer = new.file_name_issuer
+            ),
+            new.type_of_audit_and_related_area_affected,
+            new.description_of_the_deficiencies_identified,
+            new.file_name_issuer
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reports_fts_delete AFTER DELETE ON reports BEGIN
+        DELETE FROM reports_fts WHERE rowid = (
+            SELECT id FROM reports_fts_rowid
+            WHERE file_name_issuer = old.file_name_issuer
+        );
+        DELETE FROM reports_fts_rowid WHERE file_name_issuer = old.file_name_issuer;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reports_fts_update AFTER UPDATE OF
+        type_of_audit_and_related_area_affected,
+        description_of_the_deficiencies_identified,
+        file_name_issuer
+    ON reports BEGIN
+        UPDATE reports_fts_rowid SET file_name_issuer = new.file_name_issuer
+        WHERE file_name_issuer = old.file_name_issuer;
+        UPDATE reports_fts SET
+            type_of_audit_and_related_area_affected
+                = new.type_of_audit_and_related_area_affected,
+            description_of_the_deficiencies_identified
+                = new.description_of_the_deficiencies_identified,
+            file_name_issuer = new.file_name_issuer
+        WHERE rowid = (
+            SELECT id FROM reports_fts_rowid
+            WHERE file_name_issuer = new.file_name_issuer
+        );
+    END
+    """,
+]
+
+# 同じレポート番号の中で、reportsがある一番新しい版だけを残す（v4でv2のビューを置き換え）
+# 新しい版のpdfが解析されるまでは古い版を表示し続ける
+CANONICAL_REPORTS_V4 = """
+CREATE VIEW canonical_reports AS
+SELECT
+    r.rowid AS report_rowid,
+    r.*,
+    l.firm_name,
+    l.country,
+    l.report_date,
+    l.pdf_url,
+    l.report_base,
+    l.revision_rank
+FROM reports AS r
+LEFT JOIN links AS l ON l.file_name = r.file_name
+WHERE l.report_base IS NULL
+    OR l.revision_rank = (
+        SELECT MAX(l2.revision_rank) FROM links AS l2
+        JOIN reports AS r2 ON r2.file_name = l2.file_name
+        WHERE l2.report_base = l.report_base
+    )
+"""
+
+# reports / linksの変更でdata_versionを進める（ダッシュボードが差分を読み込む）
+BUMP_VERSION = "UPDATE data_version SET version = version + 1 WHERE name = 'reports';"
+BUMP_GENERATION = (
+    "UPDATE data_version SET version = version + 1, generation = generation + 1"
+    + " WHERE name = 'reports';"
+)
+DATA_VERSION_TRIGGERS = {
+    ("reports", "INSERT"): BUMP_VERSION,
+    ("reports", "UPDATE"): BUMP_GENERATION,
+    ("reports", "DELETE"): BUMP_GENERATION,
+    ("links", "INSERT"): BUMP_VERSION,
+    ("links", "UPDATE"): BUMP_GENERATION,
+    ("links", "DELETE"): BUMP_GENERATION,
+}
+
+
+def _add_column(conn: Connection, table: str, column: str, type_: str) -> None:
+    """列が無ければ追加（create_allで作ったばかりのテーブルには既にある）"""
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {type_}")
+
+
+def _v1_indexes(conn: Connection) -> None:
+    """絞り込み・結合に使う列のインデックス（models.pyのindex=Trueと同じ名前）"""
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_links_report_date ON links (report_date)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_links_firm_name ON links (firm_name)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_reports_file_name ON reports (file_name)"
+    )
+
+
+def _v2_canonical_reports(conn: Connection) -> None:
+    """linksにレポート番号と版を追加し、canonical_reportsビューを作成"""
+    _add_column(conn, "links", "report_base", "VARCHAR")
+    _add_column(conn, "links", "revision_rank", "INTEGER")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_links_report_base"
+        + " ON links (report_base, revision_rank)"
+    )
+
+    rows = conn.exec_driver_sql("SELECT file_name, pdf_url FROM links").fetchall()
+    params = [
+        dict(report_revision(pdf_url), file_name=file_name)
+        for file_name, pdf_url in rows
+    ]
+    if params:
+        conn.exec_driver_sql(
+            "UPDATE links SET report_base = :report_base,"
+            + " revision_rank = :revision_rank WHERE file_name = :file_name",
+            params,
+        )
+    conn.exec_driver_sql(CANONICAL_REPORTS)
+
+
+def _v3_reports_fts(conn: Connection) -> None:
+    """reportsの全文検索テーブル（FTS5）とトリガーを作成し、既存の行を登録"""
+    for statement in REPORTS_FTS:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("DELETE FROM reports_fts")
+    conn.exec_driver_sql("DELETE FROM reports_fts_rowid")
+    conn.exec_driver_sql(
+        "INSERT INTO reports_fts_rowid (file_name_issuer)"
+        + " SELECT file_name_issuer FROM reports"
+    )
+    conn.exec_driver_sql(
+        """
+        INSERT INTO reports_fts (
+            rowid,
+            type_of_audit_and_related_area_affected,
+            description_of_the_deficiencies_identified,
+            file_name_issuer
+        )
+        SELECT
+            m.id,
+            r.type_of_audit_and_related_area_affected,
+            r.description_of_the_deficiencies_identified,
+            r.file_name_issuer
+        FROM reports AS r
+        JOIN reports_fts_rowid AS m ON m.file_name_issuer = r.file_name_issuer
+        """
+    )
+
+
+def _v4_data_version(conn: Connection) -> None:
+    """data_versionとそれを進めるトリガーを作成し、canonical_reportsにrowidを追加"""
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO data_version (name, version, generation)"
+        + " VALUES ('reports', 0, 0)"
+    )
+    for (table, event), statement in DATA_VERSION_TRIGGERS.items():
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS data_version_{table}_{event.lower()}"
+            + f" AFTER {event} ON {table} BEGIN {statement} END"
+        )
+
+    conn.exec_driver_sql("DROP VIEW IF EXISTS canonical_reports")
+    conn.exec_driver_sql(CANONICAL_REPORTS_V4)
+
+
+def _v5_report_rollup(conn: Connection) -> None:
+    """report_rollup（グラフ用の集計、create_allで作成済み）を初めて集計"""
+    refresh_rollup(conn)
+
+
+# 追加するときは末尾に足す（リストの位置+1がuser_version）
+MIGRATIONS: List[Migration] = [
+    _v1_indexes,
+    _v2_canonical_reports,
+    _v3_reports_fts,
+    _v4_data_version,
+    _v5_report_rollup,
+]
+
+
+def get_version(conn: Connection) -> int:
+    """DBのスキーマのバージョン（PRAGMA user_version）"""
+    return int(conn.exec_driver_sql("PRAGMA user_version").scalar() or 0)
+
+
+def is_up_to_date(bind: Any = engine) -> bool:
+    """全てのマイグレーションが適用済みか（書き込みはしない、ダッシュボード用）
+    Args:
+        bind(Engine): DBのエンジン
+    Returns:
+        up_to_date(bool): user_versionが最新ならTrue
+    """
+    with bind.connect() as conn:
+        return get_version(conn) >= len(MIGRATIONS)
+
+
+def migrate(bind: Any = engine) -> int:
+    """テーブルを作成し、未適用のマイグレーションを適用
+    Args:
+        bind(Engine): DBのエンジン
+    Returns:
+        version(int): 適用後のuser_version
+    """
+    Base.metadata.create_all(bind=bind)
+
+    with bind.begin() as conn:
+        version = get_version(conn)
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"migrate: v{i} {migration.__name__}")
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {i}")
+            version = i
+
+        # 統計情報を更新してクエリプランナーにインデックスを使わせる
+        conn.exec_driver_sql("PRAGMA optimize")
+
+    return version
+
+
+if __name__ == "__main__":
+    print("user_version:", migrate())
@@ -1,16 +1,29 @@
-from sqlalchemy import Column, Date, ForeignKey, String
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+)
 
-from database import Base, engine
+from backend.database import Base
 
 
 class Link(Base):
     __tablename__ = "links"
 
-    firm_name = Column(String)
+    firm_name = Column(String, index=True)
     country = Column(String)
-    report_date = Column(Date)
+    report_date = Column(Date, index=True)
     pdf_url = Column(String, primary_key=True)
     file_name = Column(String, unique=True)
+    report_base = Column(String)  # レポート番号（104-2021-175）
+    revision_rank = Column(Integer)  # 版の新しさ（通常0 / xxxa 1 / -expanded 2）
+
+    __table_args__ = (Index("ix_links_report_base", "report_base", "revision_rank"),)
 
 
 class Report(Base):
@@ -20,10 +33,70 @@ class Report(Base):
     industry = Column(String)
     type_of_audit_and_related_area_affected = Column(String)
     description_of_the_deficiencies_identified = Column(String)
-    file_name = Column(String, ForeignKey("links.file_name"))
+    file_name = Column(String, ForeignKey("links.file_name"), index=True)
     file_name_issuer = Column(String, primary_key=True)
 
 
-if __name__ == "__main__":
-    # テーブルの作成
-    Base.metadata.create_all(bind=engine)
+class Download(Base):
+    __tablename__ = "downloads"
+
+    pdf_url = Column(String, ForeignKey("links.pdf_url"), primary_key=True)
+    file_name = Column(String)
+    etag = Column(String)
+    last_modified = Column(String)
+    size = Column(Integer)
+    sha256 = Column(String)
+    fetched_at = Column(DateTime)
+
+
+class ParseLedger(Base):
+    __tablename__ = "parse_ledger"
+
+    file_name = Column(String, ForeignKey("links.file_name"), primary_key=True)
+    sha256 = Column(String)
+    parser_version = Column(Integer)
+    status = Column(String)  # ok / no_issuers / error
+    message = Column(String)
+    parsed_at = Column(DateTime)
+
+
+class CrawlState(Base):
+    __tablename__ = "crawl_state"
+
+    name = Column(String, primary_key=True)  # クロール対象（"links"）
+    newest_report_date = Column(Date)
+    newest_file_name = Column(String)
+    page_count = Column(Integer)
+    last_full_sweep_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+class TextCache(Base):
+    __tablename__ = "text_cache"
+
+    cache_key = Column(String, primary_key=True)  # sha256 + 抽出設定
+    file_name = Column(String)
+    text = Column(LargeBinary)  # zlibで圧縮したテキスト
+    size = Column(Integer)  # 圧縮後のバイト数
+    created_at = Column(DateTime)
+    last_used_at = Column(DateTime)
+
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+
+    name = Column(String, primary_key=True)  # 対象のデータ（"reports"）
+    version = Column(Integer)  # reports / linksが変わるたびに+1（トリガー）
+    generation = Column(Integer)  # 追加以外の変更（更新・削除）で+1（全件読み直しが必要）
+
+
+class ReportRollup(Base):
+    __tablename__ = "report_rollup"
+
+    id = Column(Integer, primary_key=True)
+    report_date = Column(Date)
+    report_month = Column(String)  # YYYY-MM
+    firm_name = Column(String)
+    country = Column(String)
+    industry = Column(String)
+    issuers = Column(Integer)  # canonical_reportsの行数（指摘のあった発行体の数）
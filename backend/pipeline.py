@@ -0,0 +1,564 @@
+"""クロール → ダウンロード → パースをまとめて実行
+
+3つのステージを上限付きのキューでつなぎ、一覧ページで見つけたpdfはすぐにダウンロード、
+ダウンロードが終わったpdfはすぐにパースする。DBへの書き込みは1つのスレッドからだけ行う。
+
+Ctrl+Cで新しい処理の受け付けを止め、処理中のものを書き込んでから終了する（2回目で強制終了）。
+次回はDBの状態（links / downloads / parse_ledger / crawl_state）から続きを再開する。
+
+python -m backend.pipeline [--mode auto|incremental|full|none]
+                           [--db-url URL] [--pdf-dir DIR]
+"""
+import argparse
+import os
+import queue
+import signal
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from backend import metrics
+from backend.database import SQLALCHEMY_DATABASE_URL, make_engine
+from backend.migrations import migrate
+from backend.models import Download
+from backend.scraper.browser import BrowserPool
+from backend.scraper.get_page_detail import (
+    FULL_SWEEP_DAYS,
+    STOP_AFTER,
+    WORKERS,
+    choose_mode,
+    crawl_full,
+    crawl_incremental,
+    load_state,
+    save_state,
+)
+from backend.scraper.parse_pdf import load_ledger, needs_parse, save_result
+from backend.scraper.utils import (
+    DOWNLOAD_WORKERS,
+    MIN_REPORT_DATE,
+    PARSE_ERROR,
+    PDF_DIR,
+    download_file,
+    local_record,
+    pdf_path,
+    read_and_parse_pdf,
+    text_cache_key,
+)
+from backend.storage import (
+    bulk_upsert,
+    evict_text_cache,
+    get_cached_texts,
+    refresh_rollup,
+    upsert_links,
+)
+
+# キューの上限（これを超えると前のステージが待つ）
+DOWNLOAD_QUEUE_SIZE = 200
+PARSE_QUEUE_SIZE = 50
+WRITE_QUEUE_SIZE = 100
+
+# パースを同時にプロセスへ渡す数（プロセス数に対する倍率）
+PARSE_IN_FLIGHT = 2
+
+_DONE = object()  # キューの終わりの目印
+
+
+class Interrupted(Exception):
+    """Ctrl+Cで中断された"""
+
+
+def _ignore_sigint() -> None:
+    """パース用プロセスはCtrl+Cを無視（終了は親プロセスが制御する）"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Pipeline:
+    """クロール・ダウンロード・パースのパイプライン
+
+    crawl（1スレッド）→ download_queue → download（download_workersスレッド）
+    → parse_queue → dispatch（1スレッド、ProcessPoolExecutorへ渡す）
+    の順に流れ、各ステージの結果はwrite_queueを通してwriterスレッドがDBに書き込む。
+    """
+
+    def __init__(
+        self,
+        engine: Any,
+        pdf_dir: str = PDF_DIR,
+        crawl_workers: int = WORKERS,
+        download_workers: int = DOWNLOAD_WORKERS,
+        parse_workers: int = os.cpu_count() or 1,
+        refresh: bool = False,
+        retry_failed: bool = False,
+        targeted: bool = True,
+        use_cache: bool = True,
+    ) -> None:
+        self.engine = engine
+        self.pdf_dir = pdf_dir
+        self.crawl_workers = crawl_workers
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        self.refresh = refresh
+        self.retry_failed = retry_failed
+        self.targeted = targeted
+        self.use_cache = use_cache
+
+        self.download_queue: "queue.Queue[Any]" = queue.Queue(DOWNLOAD_QUEUE_SIZE)
+        self.parse_queue: "queue.Queue[Any]" = queue.Queue(PARSE_QUEUE_SIZE)
+        self.write_queue: "queue.Queue[Any]" = queue.Queue(WRITE_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        self._queued: Set[str] = set()  # ダウンロードキューに入れたURL
+        self._queued_lock = threading.Lock()
+
+        # 起動時点のDBの状態（以降はwriterスレッドだけが書き込む）
+        with Session(engine) as session:
+            self.manifest: Dict[str, Dict[str, Any]] = {
+                download.pdf_url: {
+                    column.name: getattr(download, column.name)
+                    for column in Download.__table__.columns
+                }
+                for download in session.query(Download)
+            }
+        self.ledger = load_ledger(engine)
+
+    def count(self, key: str, value: int = 1) -> None:
+        """統計を加算"""
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def put(self, q: "queue.Queue[Any]", item: Any) -> None:
+        """キューに入れる（満杯なら空くまで待つ）
+        中断されたら、書き込みと終わりの目印以外は諦めてInterruptedを送出する
+        """
+        while True:
+            if self.stop.is_set() and q is not self.write_queue and item is not _DONE:
+                raise Interrupted()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    # --- crawl ---
+
+    def enqueue_download(self, record: Dict[Any, Any]) -> None:
+        """linksの行をダウンロードキューに入れる（対象外・重複は除く）"""
+        url = record["pdf_url"]
+        if str(record["report_date"]) < MIN_REPORT_DATE:
+            return
+        if url in self.manifest and not self.refresh:
+            return
+        with self._queued_lock:
+            if url in self._queued:
+                return
+            self._queued.add(url)
+
+        self.put(self.download_queue, url)
+
+    def on_page(self, df: pd.DataFrame) -> None:
+        """一覧ページを1ページ取得したら、linksに書き込んでダウンロードに回す"""
+        if self.stop.is_set():
+            raise Interrupted()
+
+        records = df.to_dict("records")
+        self.put(self.write_queue, ("links", records))
+        self.count("pages")
+        for record in records:
+            self.enqueue_download(record)
+
+    def crawl(self, mode: str, stop_after: int, full_sweep_days: int) -> None:
+        """一覧ページをクロール（mode=noneならクロールせずに残りだけ処理する）"""
+        if mode == "none":
+            return
+
+        try:
+            self._crawl(mode, stop_after, full_sweep_days)
+        except Interrupted:
+            print("Interrupted - crawl")
+        except Exception as e:
+            self.count("failed_crawls")
+            print("Error - crawl:", e)
+
+    def _crawl(self, mode: str, stop_after: int, full_sweep_days: int) -> None:
+        """一覧ページをクロールしてクロール状態を保存"""
+        state = load_state(self.engine)
+        mode = choose_mode(state, mode, full_sweep_days)
+        print("mode:", mode)
+
+        pool = BrowserPool(size=self.crawl_workers)
+        failed: List[int] = []
+        page_count: Optional[int] = None
+        try:
+            if mode == "full":
+                df, page_count, failed = crawl_full(
+                    pool, self.crawl_workers, self.on_page
+                )
+            else:
+                links = pd.read_sql(sql="SELECT file_name FROM links", con=self.engine)
+                df, page_count = crawl_incremental(
+                    pool,
+                    set(links["file_name"]),
+                    state.page_count,  # type: ignore
+                    stop_after,
+                    self.on_page,
+                )
+        finally:
+            pool.close()
+
+        if failed:
+            self.count("failed_pages", len(failed))
+            print("Failed pages:", failed)
+        self.put(
+            self.write_queue,
+            ("state", (state, df, page_count, mode == "full" and not failed)),
+        )
+
+    def resume(self) -> None:
+        """前回までに見つけて、まだダウンロード・パースしていないものを再開"""
+        try:
+            self._resume()
+        except Interrupted:
+            print("Interrupted - resume")
+
+    def _resume(self) -> None:
+        """DBの状態からダウンロード・パースの残りをキューに入れる"""
+        links = pd.read_sql(
+            sql="SELECT pdf_url, file_name, report_date FROM links \
+                WHERE report_date >= ? ORDER BY report_date DESC, file_name DESC",
+            con=self.engine,
+            params=(MIN_REPORT_DATE,),
+        )
+        rows = []
+        for record in links.to_dict("records"):
+            download = self.manifest.get(record["pdf_url"])
+            if download is None:
+                self.enqueue_download(record)
+            elif needs_parse(
+                self.ledger.get(download["file_name"]),
+                download["sha256"],
+                retry_failed=self.retry_failed,
+            ):
+                rows.append(self.make_row(download["file_name"], download["sha256"]))
+
+        # 抽出済みテキストはまとめて取得
+        if self.use_cache and rows:
+            texts = get_cached_texts(self.engine, [row.cache_key for row in rows])
+            for row in rows:
+                row.text = texts.get(row.cache_key)
+            self.count("text_cache_hits", len(texts))
+
+        print("resume - parse:", len(rows))
+        for row in rows:
+            self.put(self.parse_queue, row)
+
+    # --- download ---
+
+    def make_row(self, file_name: str, sha256: str) -> SimpleNamespace:
+        """パースに渡す行"""
+        row = SimpleNamespace(file_name=file_name, sha256=sha256)
+        if self.use_cache:
+            row.cache_key = text_cache_key(sha256, self.targeted)
+
+        return row
+
+    def download(self) -> None:
+        """ダウンロードキューのpdfをダウンロードしてパースに回す"""
+        while True:
+            url = self.download_queue.get()
+            if url is _DONE:
+                return
+            if self.stop.is_set():
+                # 中断後は終わりの目印まで読み捨てる（次回resumeで再開）
+                continue
+
+            file_path = pdf_path(self.pdf_dir, url)
+            manifest = self.manifest.get(url)
+            try:
+                if manifest is None and not self.refresh and os.path.isfile(file_path):
+                    # manifest導入前にダウンロードしたファイルは登録だけする
+                    record = local_record(url, file_path)
+                else:
+                    record = download_file(url, file_path, manifest)
+            except Exception as e:
+                self.count("failed_downloads")
+                print("Error - download:", url, e)
+                continue
+
+            self.count("downloads")
+            self.count("download_bytes", record["size"] or 0)
+            self.put(self.write_queue, ("download", record))
+
+            if needs_parse(
+                self.ledger.get(record["file_name"]),
+                record["sha256"],
+                retry_failed=self.retry_failed,
+            ):
+                row = self.make_row(record["file_name"], record["sha256"])
+                try:
+                    self.put(self.parse_queue, row)
+                except Interrupted:
+                    continue
+
+    # --- parse ---
+
+    def dispatch(self, executor: Optional[ProcessPoolExecutor]) -> None:
+        """パースキューのpdfをプロセスに渡す（同時に渡す数は上限付き）"""
+        worker = partial(
+            read_and_parse_pdf, folder_path=self.pdf_dir, targeted=self.targeted
+        )
+        slots = threading.BoundedSemaphore(max(1, self.parse_workers) * PARSE_IN_FLIGHT)
+        futures: List[Future] = []
+
+        def done(future: Future) -> None:
+            slots.release()
+            try:
+                self.put(self.write_queue, ("parsed", future.result()))
+            except Exception as e:
+                # プロセスが落ちた場合など（ledgerに残らないので次回やり直す）
+                self.count("failed_parses")
+                print("Error - parse:", e)
+
+        while True:
+            row = self.parse_queue.get()
+            if row is _DONE:
+                break
+            if self.stop.is_set():
+                # 中断後は終わりの目印まで読み捨てる（次回resumeで再開）
+                continue
+
+            if executor is None:
+                self.put(self.write_queue, ("parsed", worker(row)))
+                continue
+
+            slots.acquire()
+            future = executor.submit(worker, row)
+            future.add_done_callback(done)
+            futures.append(future)
+
+        # 渡した分は最後まで処理する
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    # --- write ---
+
+    def write(self) -> None:
+        """DBへの書き込み（このスレッドだけが書き込む）"""
+        while True:
+            item = self.write_queue.get()
+            if item is _DONE:
+                return
+
+            kind, value = item
+            try:
+                self._write(kind, value)
+            except Exception as e:
+                self.count("failed_writes")
+                print("Error - write:", kind, e)
+
+    def _write(self, kind: str, value: Any) -> None:
+        """1件書き込む"""
+        if kind == "links":
+            result = upsert_links(self.engine, value)
+            self.count("links_inserted", result.inserted)
+        elif kind == "download":
+            bulk_upsert(self.engine, Download, [value])
+        elif kind == "parsed":
+            row, details, error = value
+            print("parsed", row.file_name)
+            status = save_result(self.engine, row, details, error, self.use_cache)
+            self.count("parsed")
+            if status == PARSE_ERROR:
+                self.count("parse_errors")
+        elif kind == "state":
+            state, df, page_count, full_sweep = value
+            save_state(state, df, page_count, full_sweep, bind=self.engine)
+
+    # --- run ---
+
+    def run(
+        self,
+        mode: str = "auto",
+        stop_after: int = STOP_AFTER,
+        full_sweep_days: int = FULL_SWEEP_DAYS,
+    ) -> None:
+        """全ステージを実行して、全て終わるまで待つ"""
+        executor = None
+        if self.parse_workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=self.parse_workers, initializer=_ignore_sigint
+            )
+
+        writer = self._start(self.write)
+        dispatcher = self._start(self.dispatch, executor)
+        downloaders = [self._start(self.download) for _ in range(self.download_workers)]
+
+        # 前回の残りと新しいクロール結果を並行してダウンロードキューに入れる
+        self._join(
+            [
+                self._start(self.resume),
+                self._start(self.crawl, mode, stop_after, full_sweep_days),
+            ]
+        )
+
+        # 前のステージが終わったら次のステージに終わりの目印を送る
+        for _ in downloaders:
+            self.put(self.download_queue, _DONE)
+        self._join(downloaders)
+        self.put(self.parse_queue, _DONE)
+        self._join([dispatcher])
+        if executor is not None:
+            executor.shutdown()
+        self.put(self.write_queue, _DONE)
+        self._join([writer])
+
+        # ダッシュボードのグラフ用の集計（中断した場合も保存した分は反映する）
+        refresh_rollup(self.engine)
+        if self.use_cache:
+            evict_text_cache(self.engine)
+
+    def _start(self, target: Callable[..., None], *args: Any) -> threading.Thread:
+        """ステージのスレッドを起動"""
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+
+        return thread
+
+    def _join(self, threads: List[threading.Thread]) -> None:
+        """スレッドの終了を待つ（待っている間もCtrl+Cを受け付ける）"""
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="クロール・ダウンロード・パースをまとめて実行")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "incremental", "full", "none"],
+        default="auto",
+        help="クロールのモード（none: クロールせず前回の残りだけ処理する）",
+    )
+    parser.add_argument(
+        "--db-url", default=SQLALCHEMY_DATABASE_URL, help="DBのURL（SQLAlchemy形式）"
+    )
+    parser.add_argument("--pdf-dir", default=PDF_DIR, help="pdfの格納先")
+    parser.add_argument(
+        "--stop-after",
+        type=int,
+        default=STOP_AFTER,
+        help="差分モードで既知のレポートが何件続いたら止めるか",
+    )
+    parser.add_argument(
+        "--full-sweep-days", type=int, default=FULL_SWEEP_DAYS, help="全ページを取り直す間隔（日）"
+    )
+    parser.add_argument(
+        "--crawl-workers", type=int, default=WORKERS, help="一覧ページを同時に取得する数"
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help="同時にダウンロードする数",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="パースに使うプロセス数（1なら並列化しない）",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ダウンロード済みのPDFも条件付きGETで更新を確認する",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="前回エラーになったPDFも再処理する"
+    )
+    parser.add_argument(
+        "--full-text",
+        action="store_true",
+        help="Part I.Aに絞らず全ページからテキストを抽出する",
+    )
+    parser.add_argument(
+        "--no-text-cache",
+        action="store_true",
+        help="抽出済みテキストのキャッシュを使わない",
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run("pipeline", args.metrics_dir, args.profile)
+
+    os.makedirs(args.pdf_dir, exist_ok=True)
+    engine = make_engine(args.db_url)
+    # テーブルが無ければ作成（既存のDBはマイグレーション）
+    migrate(engine)
+
+    pipeline = Pipeline(
+        engine,
+        pdf_dir=args.pdf_dir,
+        crawl_workers=args.crawl_workers,
+        download_workers=args.download_workers,
+        parse_workers=args.parse_workers,
+        refresh=args.refresh,
+        retry_failed=args.retry_failed,
+        targeted=not args.full_text,
+        use_cache=not args.no_text_cache,
+    )
+
+    def interrupt(signum: int, frame: Any) -> None:
+        # 1回目は処理中のものを書き込んでから終了、2回目は強制終了
+        print("Interrupted - finishing in-flight work (Ctrl+C again to abort)")
+        pipeline.stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, interrupt)
+    try:
+        pipeline.run(args.mode, args.stop_after, args.full_sweep_days)
+    except KeyboardInterrupt:
+        # ダウンロードは.part、DBはトランザクション単位なので途中で落としても再開できる
+        print("Aborted")
+        os._exit(130)
+
+    metrics.finish_run()
+
+    stats = pipeline.stats
+    print(
+        f"pages: {stats['pages']}, new links: {stats['links_inserted']},"
+        + f" downloads: {stats['downloads']} ({stats['download_bytes']} bytes),"
+        + f" parsed: {stats['parsed']}"
+    )
+    failures = {
+        key: stats[key]
+        for key in [
+            "failed_crawls",
+            "failed_pages",
+            "failed_downloads",
+            "failed_parses",
+            "parse_errors",
+            "failed_writes",
+        ]
+        if stats[key]
+    }
+    if failures:
+        print("Failed:", failures)
+        sys.exit(1)
+    if pipeline.stop.is_set():
+        print("Interrupted - run again to resume")
+        sys.exit(130)
+
+    print("Done pipeline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""ダッシュボード用のcanonical_reportsのキャッシュ
+
+data_version（取り込み側のトリガーで更新）を毎回確認し、
+- 変わっていなければそのまま
+- 追加だけなら、前回より後に追加された行（rowid）だけを読み込んで結合
+- 更新・削除があれば（generationが変わったら）全件を読み直す
+
+グラフ用の集計（report_rollup）は取り込みの最後に作られる。
+集計が今のバージョンより古ければ（取り込み中など）読み込んだdfから集計する。
+"""
+import threading
+from typing import Any, NamedTuple, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from backend.filter_index import FilterIndex
+from backend.storage import get_data_version
+
+SORT_COLUMNS = ["report_date", "firm_name", "issuer"]
+SORT_ASCENDING = [False, True, True]
+ROLLUP_KEYS = ["report_date", "firm_name", "country", "industry"]
+
+
+class Snapshot(NamedTuple):
+    """refreshした時点のインデックス・集計・バージョン（同じ時点のものの組）"""
+
+    filter_index: FilterIndex
+    rollup: FilterIndex
+    version: Tuple[int, int]
+
+
+class ReportCache:
+    """canonical_reportsのdfと絞り込み用インデックス（セッションをまたいで共有）"""
+
+    def __init__(self, bind: Any) -> None:
+        self.bind = bind
+        self.version: Optional[Tuple[int, int]] = None
+        self.max_rowid = 0
+        self.index: Optional[FilterIndex] = None  # 最初のrefreshで作る
+        self.rollup: Optional[FilterIndex] = None  # report_rollupの絞り込み用
+        self._lock = threading.Lock()
+
+    def _read(self, conn: Any, after_rowid: int) -> pd.DataFrame:
+        """after_rowidより後に追加されたreportsを読み込む"""
+        df = pd.read_sql(
+            text(
+                "SELECT * FROM canonical_reports WHERE report_rowid > :rowid"
+                + " ORDER BY report_date DESC, firm_name ASC, issuer ASC"
+            ).bindparams(rowid=after_rowid),
+            conn,
+        )
+        df["report_date"] = pd.to_datetime(df["report_date"])
+
+        return df
+
+    def _rollup_from_df(self) -> pd.DataFrame:
+        """読み込んだdfから集計（report_rollupと同じ形）"""
+        df = self.index.df  # type: ignore
+        rollup = (
+            df.groupby(ROLLUP_KEYS, dropna=False).size().reset_index(name="issuers")
+        )
+        rollup["report_month"] = rollup["report_date"].dt.strftime("%Y-%m")
+
+        return rollup
+
+    def _merge(self, new: pd.DataFrame) -> pd.DataFrame:
+        """追加分を結合（新しい版が来たレポート番号の古い版は除く）"""
+        df = self.index.df  # type: ignore
+        latest = new.groupby("report_base")["revision_rank"].max()
+        superseded = df["revision_rank"] < df["report_base"].map(latest)
+        df = pd.concat([df[~superseded], new], ignore_index=True)
+
+        return df.sort_values(SORT_COLUMNS, ascending=SORT_ASCENDING, kind="stable")
+
+    def _snapshot(self) -> Snapshot:
+        """今のインデックス・集計・バージョン（_lockの中で呼ぶ）"""
+        return Snapshot(self.index, self.rollup, self.version)  # type: ignore
+
+    def refresh(self) -> Snapshot:
+        """DBが変わっていれば読み込む
+        他のセッションのrefreshで入れ替わることがあるので、
+        呼び出し側はself.indexなどではなく戻り値だけを使う
+        Returns:
+            snapshot(Snapshot): 読み込んだ後のインデックス・集計・バージョン
+        """
+        with self._lock:
+            # バージョンと行を同じトランザクション（スナップショット）で読む
+            with self.bind.connect() as conn, conn.begin():
+                version = get_data_version(conn)
+                if version == self.version:
+                    return self._snapshot()
+
+                full = self.version is None or version[1] != self.version[1]
+                new = self._read(conn, 0 if full else self.max_rowid)
+
+                rollup = None
+                if get_data_version(conn, "report_rollup") == version:
+                    rollup = pd.read_sql("SELECT * FROM report_rollup", conn)
+                    rollup["report_date"] = pd.to_datetime(rollup["report_date"])
+
+            if full:
+                self.index = FilterIndex(new)
+                self.max_rowid = 0
+            elif len(new):
+                self.index = FilterIndex(self._merge(new))
+            # linksだけの追加なら表示は変わらない
+
+            if len(new):
+                self.max_rowid = max(self.max_rowid, int(new["report_rowid"].max()))
+            self.rollup = FilterIndex(
+                rollup if rollup is not None else self._rollup_from_df()
+            )
+            self.version = version
+
+            return self._snapshot()
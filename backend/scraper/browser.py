@@ -0,0 +1,181 @@
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import chromedriver_binary  # NOQA
+from selenium import webdriver
+
+from backend.metrics import inc, timer
+
+# プール設定
+POOL_SIZE = 1  # 同時に起動するブラウザ数
+MAX_PAGES = 50  # 1セッションで開くページ数の上限（超えたら再起動）
+
+
+def make_options() -> webdriver.ChromeOptions:
+    """driverのオプション設定
+    Returns:
+        options(ChromeOptions): ヘッドレスChromeのオプション
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("no-sandbox")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--allow-running-insecure-content")
+    options.add_argument("--disable-web-security")
+    options.add_argument("--disable-desktop-notifications")
+    options.add_argument("--lang=ja")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument('--proxy-server="direct://"')
+    options.add_argument("--proxy-bypass-list=*")
+    options.add_argument("--start-maximized")
+
+    return options
+
+
+class BrowserPool:
+    """使い回し可能なWebDriverセッションのプール
+
+    get_soupなどのクロール関数はacquireで借りてreleaseで返す。
+    貸し出し時（acquire）にヘルスチェックを行い、応答しないセッションは
+    quitして新しく起動する。返却時（release）は壊れたセッションや
+    max_pagesを超えたセッションをquitする。
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_pages: int = MAX_PAGES) -> None:
+        self.size = size
+        self.max_pages = max_pages
+        self._idle: "queue.LifoQueue[webdriver.Chrome]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._pages: Dict[int, int] = {}  # id(driver) -> 開いたページ数
+        self._drivers: Dict[int, webdriver.Chrome] = {}
+        self._closed = False
+
+    def _start(self) -> webdriver.Chrome:
+        """新しいセッションを起動"""
+        with timer("browser_start_seconds"):
+            driver = webdriver.Chrome("chromedriver", options=make_options())
+        inc("browser_sessions")
+        with self._lock:
+            self._pages[id(driver)] = 0
+            self._drivers[id(driver)] = driver
+
+        return driver
+
+    def _quit(self, driver: webdriver.Chrome) -> None:
+        """セッションを終了（driverプロセスも落とす）"""
+        with self._lock:
+            self._pages.pop(id(driver), None)
+            self._drivers.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            print("Error - quit driver:", e)
+
+    @staticmethod
+    def is_healthy(driver: webdriver.Chrome) -> bool:
+        """セッションが応答するか確認"""
+        try:
+            driver.execute_script("return 1")
+        except Exception:
+            return False
+
+        return True
+
+    def acquire(self, timeout: Optional[float] = None) -> webdriver.Chrome:
+        """セッションを借りる
+        Args:
+            timeout(float): 空きを待つ秒数（Noneなら無制限）
+        Returns:
+            driver(Chrome): WebDriver
+        """
+        if self._closed:
+            raise RuntimeError("BrowserPool is closed")
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No browser session available")
+
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._start()
+                if self.is_healthy(driver):
+                    return driver
+                self._quit(driver)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver: webdriver.Chrome, broken: bool = False) -> None:
+        """セッションを返す
+        Args:
+            driver(Chrome): acquireで借りたWebDriver
+            broken(bool): 例外などで状態が怪しい場合はTrue
+        """
+        try:
+            with self._lock:
+                pages = self._pages.get(id(driver), 0) + 1
+                self._pages[id(driver)] = pages
+                # closeと同じロックの中で判定する（close後に空きへ戻さない）
+                reuse = not (broken or self._closed or pages >= self.max_pages)
+                if reuse:
+                    self._idle.put(driver)
+
+            if not reuse:
+                # 壊れたか、上限に達したか、プールが閉じられたセッションは終了する
+                self._quit(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None) -> Iterator[webdriver.Chrome]:
+        """with文でセッションを借りる"""
+        driver = self.acquire(timeout=timeout)
+        try:
+            yield driver
+        except BaseException:
+            self.release(driver, broken=True)
+            raise
+        else:
+            self.release(driver)
+
+    def close(self) -> None:
+        """空いているセッションをquit（貸し出し中のものはreleaseでquitする）"""
+        drivers = []
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    drivers.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+        for driver in drivers:
+            self._quit(driver)
+
+    def __enter__(self) -> "BrowserPool":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+
+_default_pool: Optional[BrowserPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """プロセス共通のプールを取得（終了時に自動でquit）"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None or _default_pool._closed:
+            _default_pool = BrowserPool()
+            atexit.register(_default_pool.close)
+
+    return _default_pool
@@ -1,60 +1,263 @@
+import argparse
+import datetime
+import itertools
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional, Set, Tuple
+
 import pandas as pd
-from sqlalchemy import create_engine
-from utils import get_last_page, get_report, get_soup
-
-# DB接続
-SQLALCHEMY_DATABASE_URL = "sqlite:///../fir.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-
-# 重複チェック用
-links = pd.read_sql(
-    sql="SELECT file_name FROM links ORDER BY report_date DESC", con=engine
-)
-
-# 最終のページを取得
-last_page = get_last_page(
-    "https://pcaobus.org/oversight/inspections/firm-inspection-reports?mpp=96"
-)
-
-# リスト取得
-for page in range(1, last_page + 1):
-    # クロール
-    url = (
-        "https://pcaobus.org/oversight/inspections/firm-inspection-reports"
-        + f"?pg={page}&mpp=96"
+from sqlalchemy.orm import Session
+
+from backend import metrics
+from backend.database import engine
+from backend.metrics import inc
+from backend.migrations import migrate
+from backend.models import CrawlState
+from backend.scraper.browser import BrowserPool
+from backend.scraper.utils import get_last_page, get_listing, listing_url
+from backend.storage import bulk_upsert, refresh_rollup, upsert_links
+
+# クロール設定（クロール先はutils.BASE_URL）
+WORKERS = 4  # 一覧ページを同時に取得する数
+STOP_AFTER = 10  # 差分モードで既知のレポートがこの件数続いたら止める
+FULL_SWEEP_DAYS = 7  # この日数ごとに全ページを取り直す（過去分の追加対策）
+STATE_NAME = "links"
+
+OnPage = Callable[[pd.DataFrame], None]
+
+
+def crawl_full(
+    pool: BrowserPool, workers: int, on_page: Optional[OnPage] = None
+) -> Tuple[pd.DataFrame, int, List[int]]:
+    """一覧ページを全てクロール
+    Args:
+        pool(BrowserPool): 使用するブラウザプール
+        workers(int): 一覧ページを同時に取得する数
+        on_page(Callable): 1ページ取得するたびに呼ぶ関数（取得した順）
+    Returns:
+        df(DataFrame): 取得したレポート一覧
+        last_page(int): 最終ページ
+        failed(List[int]): 取得に失敗したページ
+    """
+    # 最終のページを取得
+    last_page = get_last_page(listing_url(), pool)
+
+    # リスト取得（ページごとに並列でクロールし、リトライもページ単位）
+    results = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(get_listing, listing_url(page), pool): page
+            for page in range(1, last_page + 1)
+        }
+        try:
+            for future in as_completed(futures):
+                page = futures[future]
+                try:
+                    results[page] = future.result()
+                    print("page:", page, "/", last_page, "rows:", len(results[page]))
+                except Exception as e:
+                    failed.append(page)
+                    print("Error - page:", page, "/", last_page, e)
+                    continue
+                if on_page is not None:
+                    on_page(results[page])
+        except BaseException:
+            # 中断されたら未着手のページは取りに行かない
+            for future in futures:
+                future.cancel()
+            raise
+
+    # ページ順に結合
+    dfs = [results[page] for page in sorted(results)]
+    df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+    return df, last_page, sorted(failed)
+
+
+def crawl_incremental(
+    pool: BrowserPool,
+    known: Set[str],
+    page_count: int,
+    stop_after: int,
+    on_page: Optional[OnPage] = None,
+) -> Tuple[pd.DataFrame, int]:
+    """新しい順にクロールし、既知のレポートがstop_after件続いたら止める
+    Args:
+        pool(BrowserPool): 使用するブラウザプール
+        known(Set[str]): DBにあるfile_name
+        page_count(int): 前回のクロール状態のページ数
+        stop_after(int): 既知のレポートが何件続いたら止めるか
+        on_page(Callable): 1ページ取得するたびに呼ぶ関数
+    Returns:
+        df(DataFrame): 取得したレポート一覧
+        page_count(int): ページ数（page_countより後のページを取得できたら増やす）
+    """
+    dfs = []
+    streak = 0
+    # 前回よりページが増えている可能性があるので、page_countより後も取得できる限り見る
+    for page in itertools.count(1):
+        try:
+            df = get_listing(listing_url(page), pool)
+        except Exception:
+            if page <= page_count:
+                raise
+            # これ以上ページは無い
+            break
+        dfs.append(df)
+        page_count = max(page_count, page)
+        print("page:", page, "rows:", len(df))
+        if on_page is not None:
+            on_page(df)
+
+        for file_name in df["file_name"]:
+            streak = streak + 1 if file_name in known else 0
+            if streak >= stop_after:
+                return pd.concat(dfs, ignore_index=True), page_count
+
+    return pd.concat(dfs, ignore_index=True), page_count
+
+
+def load_state(bind: Any = engine) -> Optional[CrawlState]:
+    """前回のクロール状態"""
+    with Session(bind) as session:
+        state = session.get(CrawlState, STATE_NAME)
+        session.expunge_all()
+
+    return state
+
+
+def save_state(
+    state: Optional[CrawlState],
+    df: pd.DataFrame,
+    page_count: Optional[int],
+    full_sweep: bool,
+    bind: Any = engine,
+) -> None:
+    """クロール状態を保存
+    Args:
+        state(CrawlState): 前回のクロール状態
+        df(DataFrame): 今回取得したレポート一覧
+        page_count(int): 今回確認したページ数（Noneなら前回の値のまま）
+        full_sweep(bool): 全ページを失敗なく取得できたか
+        bind(Engine): 書き込み先
+    """
+    now = datetime.datetime.now()
+    newest_report_date = state.newest_report_date if state else None
+    newest_file_name = state.newest_file_name if state else None
+    if len(df):
+        newest = df.sort_values(["report_date", "file_name"]).iloc[-1]
+        if newest_report_date is None or newest["report_date"] >= newest_report_date:
+            newest_report_date = newest["report_date"]
+            newest_file_name = newest["file_name"]
+
+    if state is not None and not full_sweep:
+        last_full_sweep_at = state.last_full_sweep_at
+    else:
+        last_full_sweep_at = now if full_sweep else None
+
+    record = {
+        "name": STATE_NAME,
+        "newest_report_date": newest_report_date,
+        "newest_file_name": newest_file_name,
+        "page_count": page_count or (state.page_count if state else None),
+        "last_full_sweep_at": last_full_sweep_at,
+        "updated_at": now,
+    }
+    bulk_upsert(bind, CrawlState, [record])
+
+
+def choose_mode(state: Optional[CrawlState], mode: str, full_sweep_days: int) -> str:
+    """クロールのモードを決める
+    Args:
+        state(CrawlState): 前回のクロール状態
+        mode(str): auto / incremental / full
+        full_sweep_days(int): 全ページを取り直す間隔（日）
+    Returns:
+        mode(str): incremental / full
+    """
+    if state is None or state.page_count is None:
+        # 初回は全件クロール
+        return "full"
+    if mode != "auto":
+        return mode
+
+    due = datetime.datetime.now() - datetime.timedelta(days=full_sweep_days)
+    if state.last_full_sweep_at is None or state.last_full_sweep_at < due:
+        return "full"
+
+    return "incremental"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="一覧ページをクロールしてlinksにInsert")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "incremental", "full"],
+        default="auto",
+        help="auto: 前回の全件クロールからfull-sweep-days経っていればfull",
+    )
+    parser.add_argument(
+        "--stop-after",
+        type=int,
+        default=STOP_AFTER,
+        help="差分モードで既知のレポートが何件続いたら止めるか",
     )
+    parser.add_argument(
+        "--full-sweep-days",
+        type=int,
+        default=FULL_SWEEP_DAYS,
+        help="全ページを取り直す間隔（日）",
+    )
+    parser.add_argument("--workers", type=int, default=WORKERS, help="一覧ページを同時に取得する数")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run("get_page_detail", args.metrics_dir, args.profile)
 
-    df = pd.DataFrame(columns=["firm_name", "country", "report_date", "pdf_url"])
-    try_num = 0
-    while len(df) == 0:
-        try_num += 1
-        # 10回までトライする
-        if try_num == 10:
-            raise Exception("Error - get_soup")
-        else:
-            print("page:", page, "/", last_page, "try:", try_num)
-            print(url)
-            soup = get_soup(url)
-            # ページをスクレイピングしてdfにまとめる
-            df = get_report(df, soup)
-
-    # 重複チェックしてDBにInsert
-    for i in range(len(df)):
-        record = df.iloc[[i]]
-        file_name = "".join(record["file_name"])
-
-        if file_name not in links["file_name"].values:
-            # DBにfile_nameの要素がなければInsert
-            record.to_sql("links", con=engine, if_exists="append", index=False)
+    # テーブルが無ければ作成（既存のDBはマイグレーション）
+    migrate(engine)
+    state = load_state()
+
+    mode = choose_mode(state, args.mode, args.full_sweep_days)
+    print("mode:", mode)
+
+    # ブラウザは並列数分だけ起動して全ページで使い回す
+    pool = BrowserPool(size=args.workers)
+
+    failed: List[int] = []
+    page_count: Optional[int] = None
+    try:
+        if mode == "full":
+            df, page_count, failed = crawl_full(pool, args.workers)
         else:
-            # 内側のループから抜ける
-            print(f'Duplicate: "{file_name}"')
-            # TODO: 過去にデータが追加されている場合、ここでbreakするとそこまで到達できない
-            # break
-    else:
-        # 内側のループが正常に終了したら次の外側ループへ
-        continue
-    # 外側のループから抜ける
-    break
+            # 前回の状態が無ければchoose_modeはfullを返す
+            assert state is not None
+            links = pd.read_sql(sql="SELECT file_name FROM links", con=engine)
+            df, page_count = crawl_incremental(
+                pool, set(links["file_name"]), state.page_count, args.stop_after
+            )
+    finally:
+        pool.close()
+
+    # 1トランザクションでまとめてUpsert
+    if len(df):
+        result = upsert_links(engine, df.to_dict("records"))
+        print(
+            f"Inserted: {result.inserted}, Updated: {result.updated},"
+            + f" Duplicate: {result.skipped}"
+        )
+        # 会社名などが変わった場合に備えてグラフ用の集計も更新
+        if result.updated:
+            print("rollup rows:", refresh_rollup(engine))
+
+    save_state(state, df, page_count, full_sweep=(mode == "full" and not failed))
+
+    inc("failed_pages", len(failed))
+    metrics.finish_run()
+    if failed:
+        print("Failed pages:", failed)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,55 @@
+import argparse
 import os
+import sys
 
 import pandas as pd
-from sqlalchemy import create_engine
 
-from utils import get_pdf
+from backend import metrics
+from backend.database import SessionLocal, engine
+from backend.migrations import migrate
+from backend.models import Download
+from backend.scraper.utils import MIN_REPORT_DATE, PDF_DIR, get_pdf
+from backend.storage import bulk_upsert
 
-# DB接続
-SQLALCHEMY_DATABASE_URL = "sqlite:///../fir.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+parser = argparse.ArgumentParser(description="PDFをダウンロード")
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="ダウンロード済みのPDFも条件付きGETで更新を確認する",
 )
+metrics.add_arguments(parser)
+args = parser.parse_args()
+metrics.start_run("get_pdf", args.metrics_dir, args.profile)
 
 # PDFを格納するフォルダを作成
-os.makedirs("./pdf", exist_ok=True)
+os.makedirs(PDF_DIR, exist_ok=True)
 
-# 2020-12-17以降のPDFをダウンロード
+# テーブルが無ければ作成（既存のDBはマイグレーション）
+migrate(engine)
+
+# ダウンロード済みのmanifest
+with SessionLocal() as session:
+    manifest = {
+        download.pdf_url: {
+            column.name: getattr(download, column.name)
+            for column in Download.__table__.columns
+        }
+        for download in session.query(Download)
+    }
+
+# MIN_REPORT_DATE以降のPDFをダウンロード
 links = pd.read_sql(
-    sql="SELECT pdf_url FROM links WHERE report_date >= '2020-12-17'", con=engine
+    sql="SELECT pdf_url FROM links WHERE report_date >= ?",
+    con=engine,
+    params=(MIN_REPORT_DATE,),
 )
-get_pdf("./pdf", links["pdf_url"])
+records, failed = get_pdf(PDF_DIR, links["pdf_url"].tolist(), manifest, args.refresh)
+
+# manifestを更新
+bulk_upsert(engine, Download, records)
+
+metrics.finish_run()
+if failed:
+    print("Failed:", len(failed))
+    sys.exit(1)
 print("Done get_pdf")
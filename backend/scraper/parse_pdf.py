@@ -1,52 +1,291 @@
+import argparse
+import datetime
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
 import pandas as pd
-from sqlalchemy import create_engine
-from utils import parse_pdf, read_pdf
+from sqlalchemy.orm import Session
 
-# DB接続
-SQLALCHEMY_DATABASE_URL = "sqlite:///../fir.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+from backend import metrics
+from backend.database import engine
+from backend.metrics import METRICS, inc, profiled, timer
+from backend.migrations import migrate
+from backend.models import ParseLedger
+from backend.scraper.utils import (
+    MIN_REPORT_DATE,
+    PARSE_ERROR,
+    PARSE_NO_ISSUERS,
+    PARSE_OK,
+    PARSER_VERSION,
+    PDF_DIR,
+    file_sha256,
+    read_and_parse_pdf,
+    text_cache_key,
 )
-
-# 重複チェック用
-reports = pd.read_sql(sql="SELECT file_name_issuer FROM reports", con=engine)
-# 抽出元df（2020-12-17以降分）
-df = pd.read_sql(
-    sql="SELECT * FROM links WHERE report_date >= '2020-12-17' \
-        ORDER BY report_date DESC, file_name DESC",
-    con=engine,
+from backend.storage import (
+    TEXT_CACHE_MAX_BYTES,
+    bulk_upsert,
+    delete_stale_reports,
+    evict_text_cache,
+    get_cached_texts,
+    invalidate_text_cache,
+    put_cached_text,
+    refresh_rollup,
+    upsert_reports,
 )
 
-for row in df.itertuples():
-    # PDFファイル
-    file_path = "./pdf/" + row.file_name
 
-    # PDF読み取り
-    text = read_pdf(file_path)
+def load_ledger(bind: Any) -> Dict[str, ParseLedger]:
+    """parse_ledgerを読み込む
+    Args:
+        bind(Engine): 読み込み先
+    Returns:
+        ledger(Dict[str, ParseLedger]): file_name -> ledgerの行
+    """
+    with Session(bind) as session:
+        ledger = {entry.file_name: entry for entry in session.query(ParseLedger)}
+        session.expunge_all()
 
-    # パース
-    try:
-        details = parse_pdf(row, text)
-    except Exception as e:
-        print(e)
-
-    # 重複チェックしてDBにInsert
-    if details is not None:
-        for i in range(len(details)):
-            record = details.iloc[[i]]
-            file_name_issuer = "".join(record["file_name_issuer"])
-
-            if file_name_issuer not in reports["file_name_issuer"].values:
-                # DBにfile_name_issuerの要素がなければInsert
-                record.to_sql("reports", con=engine, if_exists="append", index=False)
-            # else:
-            # 内側のループから抜ける
-            #  print(f'"{file_name_issuer}" was a duplicate.')
-            # break
-        else:
-            # 内側のループが正常に終了したら次の外側ループへ
+    return ledger
+
+
+def needs_parse(
+    entry: Optional[ParseLedger],
+    sha256: str,
+    force: bool = False,
+    retry_failed: bool = False,
+) -> bool:
+    """パースし直す必要があるか（変更の無いPDFはfitzで開かずにスキップ）
+    Args:
+        entry(ParseLedger): 前回のledgerの行
+        sha256(str): 今のPDFのSHA-256
+        force(bool): ledgerを無視して再処理する
+        retry_failed(bool): 前回エラーになったPDFも再処理する
+    Returns:
+        needs_parse(bool): パースが必要ならTrue
+    """
+    return (
+        force
+        or entry is None
+        or entry.sha256 != sha256
+        or entry.parser_version != PARSER_VERSION
+        or (entry.status == PARSE_ERROR and retry_failed)
+    )
+
+
+def save_result(
+    bind: Any,
+    row: Any,
+    details: Optional[pd.DataFrame],
+    error: Optional[str],
+    use_cache: bool = True,
+) -> str:
+    """パース結果をreportsとparse_ledgerに書き込む（1トランザクション）
+    今回のパース結果に無いreportsの行（前回のパースでだけ出てきたIssuer）は削除する
+    Args:
+        bind(Engine): 書き込み先
+        row(SimpleNamespace): read_and_parse_pdfが返したrow
+        details(DataFrame): パース後のdf
+        error(str): エラーメッセージ
+        use_cache(bool): 新しく抽出したテキストをキャッシュに保存する
+    Returns:
+        status(str): PARSE_OK / PARSE_NO_ISSUERS / PARSE_ERROR
+    """
+    if error is not None:
+        print(error)
+        status = PARSE_ERROR
+    elif details is None:
+        status = PARSE_NO_ISSUERS
+    else:
+        status = PARSE_OK
+        # 項目が欠けていたIssuerはledgerのmessageに残す
+        warnings = getattr(row, "warnings", [])
+        if warnings:
+            print("warnings:", warnings)
+            error = "; ".join(warnings)
+
+    # 子プロセスで計測した値を合算
+    METRICS.merge(getattr(row, "metrics", None))
+    inc("pdfs_parsed", status=status)
+
+    # reportsへのUpsertとledgerへの記録を1トランザクションで行う
+    with profiled("db"), timer("db_transaction_seconds", table="reports"):
+        with bind.begin() as conn:
+            if status != PARSE_ERROR:
+                # 前回のパースでだけ出てきたIssuerは消す（Issuerが無ければ全て）
+                keep = [] if details is None else list(details["file_name_issuer"])
+                deleted = delete_stale_reports(conn, row.file_name, keep)
+                if deleted:
+                    print("Deleted:", deleted)
+            if details is not None:
+                result = upsert_reports(conn, details.to_dict("records"))
+                print(
+                    f"Inserted: {result.inserted}, Updated: {result.updated},"
+                    + f" Duplicate: {result.skipped}"
+                )
+            bulk_upsert(
+                conn,
+                ParseLedger,
+                [
+                    {
+                        "file_name": row.file_name,
+                        "sha256": row.sha256,
+                        "parser_version": PARSER_VERSION,
+                        "status": status,
+                        "message": error,
+                        "parsed_at": datetime.datetime.now(),
+                    }
+                ],
+            )
+            if use_cache and getattr(row, "extracted", False):
+                put_cached_text(conn, row.cache_key, row.file_name, row.text)
+
+    return status
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PDFをパースしてreportsにInsert")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="パースに使うプロセス数（1なら並列化しない）",
+    )
+    parser.add_argument("--chunksize", type=int, default=4, help="1回でプロセスに渡すPDFの数")
+    parser.add_argument(
+        "--full-text",
+        action="store_true",
+        help="Part I.Aに絞らず全ページからテキストを抽出する",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="前回エラーになったPDFも再処理する"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="parse_ledgerを無視して全PDFを再処理する"
+    )
+    parser.add_argument(
+        "--no-text-cache",
+        action="store_true",
+        help="抽出済みテキストのキャッシュを使わない",
+    )
+    parser.add_argument(
+        "--clear-text-cache",
+        action="store_true",
+        help="抽出済みテキストのキャッシュを全て削除してから実行する",
+    )
+    parser.add_argument(
+        "--text-cache-mb",
+        type=int,
+        default=TEXT_CACHE_MAX_BYTES // (1024 * 1024),
+        help="抽出済みテキストのキャッシュの上限（MB、圧縮後）",
+    )
+    parser.add_argument("--list-failed", action="store_true", help="エラーになったPDFを表示して終了")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run("parse_pdf", args.metrics_dir, args.profile)
+
+    # テーブルが無ければ作成（既存のDBはマイグレーション）
+    migrate(engine)
+
+    if args.clear_text_cache:
+        print("text cache cleared:", invalidate_text_cache(engine))
+
+    ledger = load_ledger(engine)
+
+    failed = sorted(
+        entry.file_name for entry in ledger.values() if entry.status == PARSE_ERROR
+    )
+    if args.list_failed:
+        for file_name in failed:
+            print(file_name, ledger[file_name].message)
+        return
+
+    # 抽出元df（MIN_REPORT_DATE以降分）
+    df = pd.read_sql(
+        sql="SELECT * FROM links WHERE report_date >= ? \
+            ORDER BY report_date DESC, file_name DESC",
+        con=engine,
+        params=(MIN_REPORT_DATE,),
+    )
+    # ダウンロード時に計算したハッシュ
+    downloads = pd.read_sql(sql="SELECT file_name, sha256 FROM downloads", con=engine)
+    hashes = dict(zip(downloads["file_name"], downloads["sha256"]))
+
+    # 変更の無いPDFはfitzで開かずにスキップ
+    rows = []
+    for record in df.to_dict("records"):
+        file_name = record["file_name"]
+        sha256 = hashes.get(file_name)
+        if sha256 is None:
+            file_path = os.path.join(PDF_DIR, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            sha256 = file_sha256(file_path)
+
+        if not needs_parse(
+            ledger.get(file_name), sha256, args.force, args.retry_failed
+        ):
             continue
-        # 外側のループから抜ける
-        break
 
-print("Done parse_pdf")
+        rows.append(SimpleNamespace(sha256=sha256, **record))  # type: ignore
+
+    print("skipped:", len(df) - len(rows), "to parse:", len(rows))
+
+    # 抽出済みテキストがあればfitzを使わずにパースだけ行う
+    targeted = not args.full_text
+    use_cache = not args.no_text_cache
+    if use_cache:
+        for row in rows:
+            row.cache_key = text_cache_key(row.sha256, targeted)
+        texts = get_cached_texts(engine, [row.cache_key for row in rows])
+        for row in rows:
+            row.text = texts.get(row.cache_key)
+        print("text cache hits:", len(texts))
+
+    errors = []
+    worker = partial(read_and_parse_pdf, targeted=targeted)
+    if args.workers > 1:
+        # PDF読み取りとパースはworkerで並列に、DBへのInsertはここで1か所から行う
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        results = executor.map(worker, rows, chunksize=args.chunksize)
+    else:
+        executor = None
+        results = map(worker, rows)
+
+    try:
+        for row, details, error in results:
+            print("parsed", row.file_name)
+            status = save_result(engine, row, details, error, use_cache)
+
+            if status == PARSE_ERROR:
+                errors.append(row.file_name)
+            elif row.file_name in failed:
+                failed.remove(row.file_name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # ダッシュボードのグラフ用の集計（途中で止まっても保存した分は反映する）
+        print("rollup rows:", refresh_rollup(engine))
+
+    if use_cache:
+        evicted = evict_text_cache(engine, args.text_cache_mb * 1024 * 1024)
+        if evicted:
+            print("text cache evicted:", evicted)
+
+    metrics.finish_run()
+
+    failed = sorted(set(failed) | set(errors))
+    if failed:
+        print("Failed (retry with --retry-failed):", failed)
+    if errors:
+        sys.exit(1)
+
+    print("Done parse_pdf")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# Part I.Aの見出しを1回の走査で拾うための正規表現
+# "(Issuer A)" や "Issuer A's" のような本文中の言及は見出しとして扱わない
+TOKEN = re.compile(
+    r"(?P<issuer>Issuer [A-W])(?![)'’])"
+    + r"|(?P<type>Type)"
+    + r"|(?P<review>In our review)"
+    + r"|(?P<description>Description of the (?:deficiencies|deficiency) identified)"
+    + r"|(?P<end>Audits with|PART I\.B|Part I\.B)"
+)
+INDUSTRY = re.compile(r"– (.*)")
+
+# 表記ゆれ修正
+INDUSTRY_ALIASES = {"Healthcare": "Health Care"}
+
+# 走査中の状態
+HEADER = "header"  # "Issuer A – Health Care" の途中
+TYPE = "type"  # "Type of audit..." の見出しの後
+REVIEW = "review"  # "In our review..." の途中
+DESCRIPTION = "description"  # "Description of the deficiencies identified" の後
+IDLE = "idle"
+
+Span = Tuple[int, int]
+
+
+@dataclass
+class IssuerRecord:
+    """Part I.AのIssuer1件分"""
+
+    issuer: str
+    industry: str = "None"
+    type_of_audit_and_related_area_affected: str = ""
+    description_of_the_deficiencies_identified: str = ""
+    spans: Dict[str, Span] = field(default_factory=dict)  # 列名 -> textの位置
+    warnings: List[str] = field(default_factory=list)
+
+
+def _strip_span(text: str, start: int, end: int) -> Span:
+    """前後の空白を除いた位置"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+
+    return start, end
+
+
+def _set_field(
+    text: str, record: IssuerRecord, column: str, start: int, end: int
+) -> None:
+    """text[start:end]を項目として格納"""
+    span = _strip_span(text, start, end)
+    setattr(record, column, text[slice(*span)])
+    record.spans[column] = span
+
+
+def _set_header(text: str, record: IssuerRecord, start: int, end: int) -> None:
+    """見出し（'Issuer A – Health Care'）から産業を格納"""
+    m = INDUSTRY.search(text, start, end)
+    if m is not None:
+        span = _strip_span(text, m.start(1), end)
+        industry = text[slice(*span)]
+        record.industry = INDUSTRY_ALIASES.get(industry, industry)
+        record.spans["industry"] = span
+
+
+def _close(text: str, record: IssuerRecord, state: str, start: int, end: int) -> None:
+    """読んでいる項目をendで閉じる（欠けた項目はwarningsに記録）"""
+    if state == HEADER:
+        _set_header(text, record, start, end)
+        record.warnings.append("missing type of audit")
+    elif state == TYPE:
+        record.warnings.append("missing type of audit")
+    elif state == REVIEW:
+        _set_field(text, record, "type_of_audit_and_related_area_affected", start, end)
+        record.warnings.append("missing description")
+    elif state == DESCRIPTION:
+        _set_field(
+            text, record, "description_of_the_deficiencies_identified", start, end
+        )
+
+
+def tokenize_part_ia(text: str) -> List[IssuerRecord]:
+    """Part I.Aを1回だけ走査してIssuerごとの項目に分ける
+    Args:
+        text(str): pdfのテキストデータ
+    Returns:
+        records(List[IssuerRecord]): Issuerごとの項目（欠けた項目はwarningsに記録）
+    """
+    records: List[IssuerRecord] = []
+    dropped: List[Tuple[str, IssuerRecord]] = []  # 読み直したIssuerと次のIssuer
+    state = IDLE
+    start = 0  # 今読んでいる項目の開始位置
+
+    for m in TOKEN.finditer(text):
+        kind = m.lastgroup
+
+        if kind == "issuer":
+            record = IssuerRecord(issuer=m.group(), spans={"issuer": m.span()})
+            if state == HEADER:
+                # 見出しの前の本文中の言及だったので読み直す
+                dropped.append((records.pop().issuer, record))
+            elif state != IDLE:
+                _close(text, records[-1], state, start, m.start())
+            records.append(record)
+            state = HEADER
+            start = m.start()
+        elif kind == "type" and state == HEADER:
+            _set_header(text, records[-1], start, m.start())
+            state = TYPE
+        elif kind == "review" and state == TYPE:
+            state = REVIEW
+            start = m.start()
+        elif kind == "description" and state == REVIEW:
+            _set_field(
+                text,
+                records[-1],
+                "type_of_audit_and_related_area_affected",
+                start,
+                m.start(),
+            )
+            state = DESCRIPTION
+            start = m.end()
+        elif kind == "end":
+            if state != IDLE:
+                _close(text, records[-1], state, start, m.start())
+                state = IDLE
+            if records and m.group() != "Audits with":
+                # Part I.Bに入ったので終わり（目次の言及は除く）
+                break
+
+    if state != IDLE:
+        # 終わりの目印が無いまま本文が終わった
+        _close(text, records[-1], state, start, len(text))
+        if state == DESCRIPTION:
+            records[-1].warnings.append("description not terminated")
+
+    # 同じIssuerが2回出てきたら後を優先
+    unique: Dict[str, IssuerRecord] = {}
+    for record in records:
+        if record.issuer in unique:
+            record.warnings.append("duplicate issuer")
+        unique[record.issuer] = record
+
+    # 読み直したまま最後まで出てこなかったIssuerは、Typeの見出しが欠けていた可能性がある
+    for issuer, following in dropped:
+        if issuer not in unique and following.issuer in unique:
+            unique[following.issuer].warnings.append(
+                f"{issuer} header without type; dropped"
+            )
+
+    return list(unique.values())
@@ -1,243 +1,844 @@
 import datetime
+import hashlib
+import json
 import os
 import re
-import time
+import threading
+import urllib.error
+import urllib.parse
 import urllib.request
-from typing import Any, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import chromedriver_binary  # NOQA
 import fitz
 import pandas as pd
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from tenacity import retry, stop_after_attempt, wait_fixed
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_fixed
+
+from backend.metrics import (
+    METRICS,
+    count_retry,
+    in_worker_process,
+    inc,
+    profile_stage,
+    timer,
+)
+from backend.scraper.browser import BrowserPool, get_browser_pool
+from backend.scraper.tokenizer import tokenize_part_ia
 
 # retry設定
 wait = wait_fixed(30)  # リトライ間隔
 stop = stop_after_attempt(5)  # リトライ回数
 
+# クロール先（環境変数FIR_BASE_URLでモックサーバーなどに差し替えられる）
+BASE_URL = os.environ.get("FIR_BASE_URL", "https://pcaobus.org").rstrip("/")
+LISTING_PATH = "/oversight/inspections/firm-inspection-reports"
+PER_PAGE = 96  # 一覧ページ1ページあたりの件数
+
+# ページ取得設定
+PAGE_TIMEOUT = 30  # セレクタが描画されるまで待つ最大秒数
+HTTP_FAST_PATH = True  # ブラウザを使わずにHTTPでの取得を先に試す
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    + "(KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36"
+)
+
+# HTTPで取得したときにリトライする（ブラウザに切り替えない）ステータス
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+# 同一ホストへの同時接続数
+HOST_CONCURRENCY = 4
+
+# get_report / get_last_page が必要とする要素
+REPORT_SELECTOR = ".media-body.sf-media-body"
+LAST_PAGE_SELECTOR = ".hawk-pagination__total-text"
+REPORT_COLUMNS = ["firm_name", "country", "report_date", "pdf_url", "file_name"]
+FILE_NAME = re.compile(r"\/[^\/]*pdf")  # URLからファイル名.pdfを抽出
+
+# HTMLパーサー（lxmlがあれば使う）
+try:
+    import lxml  # NOQA
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# 一覧ページ単位のリトライ設定
+page_wait = wait_exponential(multiplier=2, max=30)
+page_stop = stop_after_attempt(5)
+
+# HTTPで取得できなかった回数（ホストごと、連続した回数。selectorが無い・エラー・タイムアウト）
+# FAST_PATH_MAX_MISSES回続いたら、そのホストは以降ブラウザのみ使う
+FAST_PATH_MAX_MISSES = 3
+_fast_path_misses: Dict[str, int] = {}
+_fast_path_lock = threading.Lock()
+
+# ダウンロード設定
+PDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf")
+MIN_REPORT_DATE = "2020-12-17"  # この日以降のレポートをダウンロード・パースする
+DOWNLOAD_WORKERS = 4  # 同時にダウンロードする数
+DOWNLOAD_TIMEOUT = 60  # 1リクエストのタイムアウト秒数
+CHUNK_SIZE = 64 * 1024  # 書き込み単位
+PART_SUFFIX = ".part"  # ダウンロード途中のファイルの拡張子
+VALIDATOR_SUFFIX = ".part.json"  # .partを受信したときのETag / Last-Modified
+download_wait = wait_exponential(multiplier=2, max=60)
+download_stop = stop_after_attempt(5)
+
+# パース設定
+PARSER_VERSION = 3  # read_pdf / parse_pdf の結果が変わる修正をしたら上げる
+PARSE_OK = "ok"
+PARSE_NO_ISSUERS = "no_issuers"  # Part I.AにIssuerが無い
+PARSE_ERROR = "error"
+
+# 読み取り設定
+CLIP_RECT = (0, 0, 612, 745)  # ヘッダー・フッターを除いた読み取り範囲
+PART_IA_TITLE = re.compile(r"Part I\.A\b", flags=re.IGNORECASE)
+PART_IA_END_TITLE = re.compile(r"Part I\.B\b|Part II\b", flags=re.IGNORECASE)
+PART_IB = re.compile(r"PART I\.B|Part I\.B")
+EXTRACTOR_VERSION = 1  # read_pdf の出力が変わる修正をしたら上げる（テキストキャッシュ用）
+
+# スレッドごとのrequests.Session
+_local = threading.local()
+
+# ホストごとの同時接続数の制限
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
+
+def listing_url(page: Optional[int] = None, base_url: Optional[str] = None) -> str:
+    """一覧ページのURL
+    Args:
+        page(int): ページ番号（省略時は1ページ目）
+        base_url(str): クロール先（省略時はBASE_URL）
+    Returns:
+        url(str): 一覧ページのURL
+    """
+    url = (base_url or BASE_URL) + LISTING_PATH
+    if page is None:
+        return url + f"?mpp={PER_PAGE}"
+
+    return url + f"?pg={page}&mpp={PER_PAGE}"
+
+
+@contextmanager
+def host_slot(url: str) -> Iterator[None]:
+    """ホストごとの同時接続数をHOST_CONCURRENCYまでに制限"""
+    host = urllib.parse.urlsplit(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.setdefault(
+            host, threading.BoundedSemaphore(HOST_CONCURRENCY)
+        )
+    with slot:
+        yield
+
+
+def make_soup(html: str, selector: Optional[str] = None) -> BeautifulSoup:
+    """HTMLをsoupに変換
+    selectorがクラスセレクタ（".a.b"）なら、そのクラスを持つ要素の中だけを解析する
+    Args:
+        html(str): HTML
+        selector(str): 必要な要素のCSSセレクタ（省略時はページ全体を解析）
+    Returns:
+        soup(BeautifulSoup): soup
+    """
+    parse_only = None
+    if selector is not None and re.fullmatch(r"(\.[\w-]+)+", selector):
+        # -> '.media-body.sf-media-body' なら両方のクラスを持つ要素だけ
+        classes = set(selector.split(".")[1:])
+        parse_only = SoupStrainer(
+            class_=lambda value: value is not None and classes.issubset(value.split())
+        )
+
+    return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
 
-@retry(wait=wait, stop=stop)
-def get_soup(url: str) -> BeautifulSoup:
-    """soup取得
+
+def get_soup_by_http(
+    url: str, selector: str, timeout: float = PAGE_TIMEOUT
+) -> Optional[BeautifulSoup]:
+    """ブラウザを使わずにHTTPでsoup取得
+    Args:
+        url(str): クロール先のURL
+        selector(str): 取得できたと判定するCSSセレクタ
+        timeout(float): タイムアウト秒数
+    Returns:
+        soup(BeautifulSoup): selectorの要素のsoup（selectorが無い、または失敗した場合はNone）
+    Raises:
+        HTTPError: 一時的なエラー（TRANSIENT_STATUS）の場合（呼び出し側でリトライ）
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    if not fast_path_enabled(url):
+        return None
+
+    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            charset = res.headers.get_content_charset() or "utf-8"
+            html = res.read().decode(charset, errors="replace")
+    except urllib.error.HTTPError as e:
+        if e.code in TRANSIENT_STATUS:
+            # ブラウザで開いても同じなのでリトライに任せる
+            raise
+        # 403などはボット対策でHTTPを拒否されている
+        print("Error - get_soup_by_http:", e)
+        count_fast_path(host, False)
+        return None
+    except OSError as e:
+        # 接続できない・タイムアウト
+        print("Error - get_soup_by_http:", e)
+        count_fast_path(host, False)
+        return None
+
+    soup = make_soup(html, selector)
+    found = soup.select_one(selector) is not None
+    count_fast_path(host, found)
+
+    return soup if found else None
+
+
+def fast_path_enabled(url: str) -> bool:
+    """このホストでHTTPでの取得を試すか（FAST_PATH_MAX_MISSES回続けて失敗したら試さない）"""
+    host = urllib.parse.urlsplit(url).netloc
+
+    return _fast_path_misses.get(host, 0) < FAST_PATH_MAX_MISSES
+
+
+def count_fast_path(host: str, found: bool) -> None:
+    """HTTPで取得できたかを記録
+    取得できなかった（selectorが無い・HTTPエラー・タイムアウト）ことが
+    FAST_PATH_MAX_MISSES回続いたら、このホストは以降ブラウザで取得する
+    Args:
+        host(str): ホスト名
+        found(bool): selectorの要素を取得できたか
+    """
+    with _fast_path_lock:
+        _fast_path_misses[host] = 0 if found else _fast_path_misses.get(host, 0) + 1
+
+
+def document_is_ready(driver: Any) -> bool:
+    """ページの読み込みが完了したか"""
+    return driver.execute_script("return document.readyState") == "complete"
+
+
+def fetch_soup(
+    url: str,
+    pool: Optional[BrowserPool] = None,
+    selector: Optional[str] = None,
+    timeout: float = PAGE_TIMEOUT,
+) -> BeautifulSoup:
+    """soup取得（リトライなし）
+    Args:
+        url(str): クロール先のURL
+        pool(BrowserPool): 使用するブラウザプール（省略時は共通プール）
+        selector(str): 描画を待つCSSセレクタ（省略時はページ読み込み完了まで待つ）
+        timeout(float): 描画を待つ最大秒数
+    Returns:
+        soup(BeautifulSoup): HTML（selectorがクラスセレクタならその要素だけ）
+    """
+    with host_slot(url):
+        # HTTPでの取得を試さないホストはfetch_seconds{method="http"}に記録しない
+        if HTTP_FAST_PATH and selector is not None and fast_path_enabled(url):
+            with timer("fetch_seconds", method="http"):
+                soup = get_soup_by_http(url, selector, timeout)
+            if soup is not None:
+                inc("pages_fetched", method="http")
+                return soup
+
+        try:
+            with timer("fetch_seconds", method="browser"):
+                soup = get_soup_by_browser(url, pool, selector, timeout)
+        except Exception:
+            inc("fetch_failures", method="browser")
+            raise
+        inc("pages_fetched", method="browser")
+
+        return soup
+
+
+def get_soup_by_browser(
+    url: str,
+    pool: Optional[BrowserPool] = None,
+    selector: Optional[str] = None,
+    timeout: float = PAGE_TIMEOUT,
+) -> BeautifulSoup:
+    """ブラウザでsoup取得
     Args:
         url(str): クロール先のURL
+        pool(BrowserPool): 使用するブラウザプール（省略時は共通プール）
+        selector(str): 描画を待つCSSセレクタ（省略時はページ読み込み完了まで待つ）
+        timeout(float): 描画を待つ最大秒数
     Returns:
-        soup(BeautifulSoup): HTML
-    """
-    # driverのオプション設定
-    options = webdriver.ChromeOptions()
-    options.add_argument("no-sandbox")
-    options.add_argument("--disable-extensions")
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
-    options.add_argument("--disable-web-security")
-    options.add_argument("--disable-desktop-notifications")
-    options.add_argument("--disable-extensions")
-    options.add_argument("--lang=ja")
-    options.add_argument("--blink-settings=imagesEnabled=false")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument('--proxy-server="direct://"')
-    options.add_argument("--proxy-bypass-list=*")
-    options.add_argument("--start-maximized")
-
-    driver = webdriver.Chrome("chromedriver", options=options)
-    driver.implicitly_wait(10)
-
-    driver.get(url)
-    time.sleep(10)
-    html = driver.page_source.encode("utf-8")
-    soup = BeautifulSoup(html, "html.parser")
-
-    driver.close()
+        soup(BeautifulSoup): HTML（selectorがクラスセレクタならその要素だけ）
+    """
+
+    pool = pool or get_browser_pool()
+
+    timed_out = False
+    with pool.driver() as driver:
+        driver.get(url)
+        try:
+            # 固定時間sleepせず、必要な要素が出たらすぐ返す
+            if selector is not None:
+                condition = EC.presence_of_element_located((By.CSS_SELECTOR, selector))
+            else:
+                condition = document_is_ready
+            WebDriverWait(driver, timeout).until(condition)
+        except TimeoutException:
+            # ブラウザ自体は正常なのでプールには戻す
+            timed_out = True
+        else:
+            html = driver.page_source
+
+    if timed_out:
+        raise TimeoutError(f"Timed out waiting for {selector!r}: {url}")
+
+    soup = make_soup(html, selector)
 
     return soup
 
 
-@retry(wait=wait, stop=stop)
-def get_last_page(url: str) -> int:
+@retry(wait=wait, stop=stop, before_sleep=count_retry("get_soup"))
+def get_soup(
+    url: str,
+    pool: Optional[BrowserPool] = None,
+    selector: Optional[str] = None,
+    timeout: float = PAGE_TIMEOUT,
+) -> BeautifulSoup:
+    """soup取得（リトライ付き）
+    Args:
+        url(str): クロール先のURL
+        pool(BrowserPool): 使用するブラウザプール（省略時は共通プール）
+        selector(str): 描画を待つCSSセレクタ（省略時はページ読み込み完了まで待つ）
+        timeout(float): 描画を待つ最大秒数
+    Returns:
+        soup(BeautifulSoup): HTML（selectorがクラスセレクタならその要素だけ）
+    """
+    return fetch_soup(url, pool, selector, timeout)
+
+
+@retry(wait=wait, stop=stop, before_sleep=count_retry("get_last_page"))
+@profile_stage("crawl")
+def get_last_page(url: str, pool: Optional[BrowserPool] = None) -> int:
     """最終ページを取得
     Args:
         url(str): クロール先のURL
+        pool(BrowserPool): 使用するブラウザプール（省略時は共通プール）
     Returns:
         last_page(int): リストの最終ページ
     """
-    soup = get_soup(url)
+    soup = get_soup(url, pool, LAST_PAGE_SELECTOR)
     last_page = re.search(
-        r"(\d)+", soup.find(class_="hawk-pagination__total-text").get_text()
+        r"(\d)+", soup.select_one(LAST_PAGE_SELECTOR).get_text()
     ).group()  # type: ignore
 
     return int(last_page)
 
 
-def get_report(df: pd.DataFrame, soup: BeautifulSoup) -> pd.DataFrame:
+@lru_cache(maxsize=4096)
+def parse_report_date(text: str) -> datetime.date:
+    """一覧ページの日付を変換（同じ日付が多いのでキャッシュする）
+    Args:
+        text(str): 'May 26, 2022' / 'Apr. 5, 2022'
+    Returns:
+        report_date(date): datetime.date(2022, 5, 26)
+    """
+    # Apr.とかの.を削除
+    return datetime.datetime.strptime(text.replace(".", ""), "%b %d, %Y").date()
+
+
+def get_report(soup: BeautifulSoup) -> List[Dict[str, Any]]:
     """一覧ページから情報を抽出
     Args:
-        df(DataFrame): 一覧ページから取得した情報を格納するdf
         soup(BeautifulSoup): soup
     Returns:
-        df(DataFrame): Argsのdf（一覧ページから取得した情報格納後）
+        records(List[Dict]): REPORT_COLUMNSの様式の行
     """
+    records = []
     for tag in soup.find_all(class_="media-body sf-media-body"):
-        firm_name = tag.find("a").get_text()
+        a = tag.find("a")
+        firm_name = a.get_text()
         # -> 'Baker Newman & Noyes, P.A. Limited Liability Company'
 
         country_and_report_date = tag.find_all(class_="lead-text-st")
         # -> [<div class="lead-text-st">United States</div>,
         #      <div class="lead-text-st">May 26, 2022</div>]
 
-        country = country_and_report_date[0].get_text()
-        # -> 'United States'
-
-        report_date = (
-            country_and_report_date[-1].get_text().replace(".", "")  # Apr.とかの.を削除
-        )
-        # -> 'May 26, 2022'
-        report_date = datetime.datetime.strptime(report_date, "%b %d, %Y")
-        report_date = datetime.date(
-            report_date.year, report_date.month, report_date.day
-        )
-        # -> datetime.date(2022, 5, 26)
-
-        pdf_url = tag.find("a").get("href")
+        pdf_url = a.get("href")
         # -> 'https://...'
 
-        tmp = pd.DataFrame(
+        records.append(
             {
-                "firm_name": [firm_name],
-                "country": [country],
-                "report_date": [report_date],
-                "pdf_url": [pdf_url],
+                "firm_name": firm_name,
+                "country": country_and_report_date[0].get_text(),
+                "report_date": parse_report_date(
+                    country_and_report_date[-1].get_text()
+                ),
+                "pdf_url": pdf_url,
+                "file_name": FILE_NAME.search(pdf_url).group()[1:],  # type: ignore
             }
         )
 
-        df = pd.concat([df, tmp], ignore_index=True)
+    return records
+
+
+@retry(wait=page_wait, stop=page_stop, before_sleep=count_retry("get_listing"))
+@profile_stage("crawl")
+def get_listing(url: str, pool: Optional[BrowserPool] = None) -> pd.DataFrame:
+    """一覧ページを1ページ取得（ページ単位でリトライ）
+    Args:
+        url(str): 一覧ページのURL
+        pool(BrowserPool): 使用するブラウザプール（省略時は共通プール）
+    Returns:
+        df(DataFrame): 一覧ページから取得した情報
+    """
+    soup = fetch_soup(url, pool, REPORT_SELECTOR)
+    records = get_report(soup)
+
+    if not records:
+        raise ValueError(f"No reports found: {url}")
+    inc("listing_pages")
+    inc("listing_reports", len(records))
+
+    return pd.DataFrame.from_records(records, columns=REPORT_COLUMNS)
+
+
+def get_session() -> requests.Session:
+    """スレッドごとのSession取得（keep-aliveで接続を使い回す）
+    Returns:
+        session(Session): requestsのSession
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = USER_AGENT
+        _local.session = session
+
+    return session
 
-    df["file_name"] = df["pdf_url"].apply(
-        lambda x: re.search(r"\/[^\/]*pdf", x).group().replace("/", "")  # type: ignore
-    )
 
-    return df
+def file_sha256(file_path: str) -> str:
+    """ファイルのSHA-256
+    Args:
+        file_path(str): ファイルパス
+    Returns:
+        sha256(str): 16進数のハッシュ値
+    """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def read_validator(validator_path: str) -> Optional[str]:
+    """.partを受信したときのIf-Rangeの値
+    Args:
+        validator_path(str): .part.jsonのパス
+    Returns:
+        if_range(str): 強いETagかLast-Modified（無ければNone）
+    """
+    try:
+        with open(validator_path) as f:
+            validator = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    etag = validator.get("etag")
+    if etag and not etag.startswith("W/"):
+        # 弱いETagはIf-Rangeに使えない
+        return etag
+
+    return validator.get("last_modified") or None
+
+
+def write_validator(validator_path: str, headers: Any) -> None:
+    """.partを受信し始めたときのETag / Last-Modifiedを保存
+    Args:
+        validator_path(str): .part.jsonのパス
+        headers(CaseInsensitiveDict): レスポンスヘッダー
+    """
+    with open(validator_path, "w") as f:
+        json.dump(
+            {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            },
+            f,
+        )
 
 
-@retry(wait=wait, stop=stop)
-def get_pdf(folder_path: str, urls: List[str]) -> None:
+def remove_part(file_path: str) -> None:
+    """.partと.part.jsonを削除
+    Args:
+        file_path(str): 保存先のファイルパス
+    """
+    for suffix in [PART_SUFFIX, VALIDATOR_SUFFIX]:
+        if os.path.isfile(file_path + suffix):
+            os.remove(file_path + suffix)
+
+
+@retry(
+    wait=download_wait,
+    stop=download_stop,
+    reraise=True,
+    before_sleep=count_retry("download_file"),
+)
+@profile_stage("download")
+def download_file(
+    url: str, file_path: str, manifest: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """1ファイルをダウンロード（ファイル単位でリトライ）
+
+    一時ファイル（.part）に書き込み、全て受信できたらリネームする。
+    .partが残っていればRange + If-Range（.part.jsonに保存したETag / Last-Modified）で
+    続きから再開する。サーバー側のファイルが変わっていれば200で最初から受信し直す。
+    manifestがあればIf-None-Match / If-Modified-Sinceを付けて、
+    更新されていなければ304で本文を受信せずに終わる。
+    Args:
+        url(str): ダウンロードURL
+        file_path(str): 保存先のファイルパス
+        manifest(Dict): downloadsテーブルの前回の行
+    Returns:
+        record(Dict): downloadsテーブルの様式の行
+    """
+    part_path = file_path + PART_SUFFIX
+    validator_path = file_path + VALIDATOR_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if_range = read_validator(validator_path) if offset else None
+    if if_range is None:
+        # 受信したときのファイルを確認できない.partは使わない
+        offset = 0
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = if_range  # type: ignore
+    elif manifest is not None and os.path.isfile(file_path):
+        if manifest.get("etag"):
+            headers["If-None-Match"] = manifest["etag"]
+        if manifest.get("last_modified"):
+            headers["If-Modified-Since"] = manifest["last_modified"]
+
+    with timer("download_seconds"), host_slot(url), get_session().get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as res:
+        if res.status_code == 304:
+            # 更新されていない
+            inc("downloads_not_modified")
+            record = dict(manifest)  # type: ignore
+            record["fetched_at"] = datetime.datetime.now()
+            return record
+        if res.status_code == 416:
+            # .partがサーバー側のファイルと合わないので最初から取り直す
+            remove_part(file_path)
+            raise IOError(f"Range not satisfiable: {url}")
+        res.raise_for_status()
+
+        if res.status_code == 206 and offset:
+            # -> 'bytes 1000-4999/5000'
+            total = int(res.headers["Content-Range"].rsplit("/", 1)[-1])
+            mode = "ab"
+        else:
+            # Rangeが無視された・ファイルが変わっていた場合は最初から書き直す
+            total = int(res.headers.get("Content-Length", -1))
+            mode = "wb"
+            write_validator(validator_path, res.headers)
+
+        with open(part_path, mode) as f:
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                inc("download_bytes", len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+
+    size = os.path.getsize(part_path)
+    if total >= 0 and size != total:
+        # 途中で切れたので.partを残して再開する
+        raise IOError(f"Incomplete download ({size}/{total} bytes): {url}")
+
+    sha256 = file_sha256(part_path)
+    os.replace(part_path, file_path)
+    remove_part(file_path)
+    inc("pdfs_downloaded")
+
+    return {
+        "pdf_url": url,
+        "file_name": os.path.basename(file_path),
+        "etag": etag,
+        "last_modified": last_modified,
+        "size": size,
+        "sha256": sha256,
+        "fetched_at": datetime.datetime.now(),
+    }
+
+
+def pdf_path(folder_path: str, url: str) -> str:
+    """pdfの保存先
+    Args:
+        folder_path(str): pdfの格納先
+        url(str): ダウンロードURL
+    Returns:
+        file_path(str): 保存先のファイルパス（ファイル名はURLの末尾の.pdf）
+    """
+    return os.path.join(folder_path, FILE_NAME.search(url).group()[1:])  # type: ignore
+
+
+def local_record(url: str, file_path: str) -> Dict[str, Any]:
+    """ダウンロード済みのファイルからdownloadsテーブルの行を作成
+    Args:
+        url(str): ダウンロードURL
+        file_path(str): 保存済みのファイルパス
+    Returns:
+        record(Dict): downloadsテーブルの様式の行（ETagなどは不明なのでNone）
+    """
+    return {
+        "pdf_url": url,
+        "file_name": os.path.basename(file_path),
+        "etag": None,
+        "last_modified": None,
+        "size": os.path.getsize(file_path),
+        "sha256": file_sha256(file_path),
+        "fetched_at": datetime.datetime.now(),
+    }
+
+
+def get_pdf(
+    folder_path: str,
+    urls: List[str],
+    manifest: Optional[Dict[str, Dict[str, Any]]] = None,
+    refresh: bool = False,
+    workers: int = DOWNLOAD_WORKERS,
+) -> Tuple[List[Dict[str, Any]], List[str]]:
     """pdfをダウンロード
     Args:
         folder_path(str): pdfの格納先
         urls(List[str]): ダウンロードURLのリスト
+        manifest(Dict): pdf_url -> downloadsテーブルの行
+        refresh(bool): manifestにあるファイルも条件付きGETで更新を確認する
+        workers(int): 同時にダウンロードする数
+    Returns:
+        records(List[Dict]): downloadsテーブルに書き込む行
+        failed(List[str]): ダウンロードに失敗したURLのリスト
+    """
+    manifest = manifest or {}
+
+    records = []
+    targets = []
+    for url in urls:
+        if url in manifest and not refresh:
+            # ダウンロード済み（ファイルの確認もしない）
+            continue
+
+        file_path = pdf_path(folder_path, url)
+        if url not in manifest and not refresh and os.path.isfile(file_path):
+            # manifest導入前にダウンロードしたファイルは登録だけする
+            records.append(local_record(url, file_path))
+            continue
+
+        targets.append((url, file_path))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_file, url, file_path, manifest.get(url)): url
+            for url, file_path in targets
+        }
+        for i, future in enumerate(as_completed(futures)):
+            url = futures[future]
+            try:
+                record = future.result()
+                records.append(record)
+                print(
+                    i + 1, "/", len(targets), "done:", url, f"({record['size']} bytes)"
+                )
+            except Exception as e:
+                failed.append(url)
+                inc("download_failures")
+                print(i + 1, "/", len(targets), "Error:", url, e)
+
+    return records, failed
+
+
+def find_part_ia_pages(doc: fitz.Document) -> Tuple[int, Optional[int]]:
+    """しおり（TOC）からPart I.Aのページ範囲を取得
+    Args:
+        doc(Document): pdf
     Returns:
-        None
+        start(int): Part I.Aの開始ページ（0始まり、見つからなければ0）
+        end(int): Part I.Bの開始ページ+1（このページまで読む、見つからなければNone）
     """
-    # ファイル名.pdfの抽出
-    pattern = re.compile(r"\/[^\/]*pdf")
+    start = None
+    end = None
+    for _, title, page in doc.get_toc(simple=True):
+        # -> [1, 'Part I.A: Audits with Unsupported Opinions', 5]
+        if start is None and PART_IA_TITLE.search(title):
+            start = page - 1
+        elif start is not None and PART_IA_END_TITLE.search(title):
+            end = page
+            break
 
-    for i, url in enumerate(urls):
-        res = re.search(pattern, url)
-        file_name = res.group()  # type: ignore
-        file_path = folder_path + file_name
+    return start or 0, end
 
-        if not os.path.isfile(file_path):
-            print(i + 1, "try:", file_name.replace("/", ""))
-            urllib.request.urlretrieve(url, file_path)
-            time.sleep(3)
 
+def iter_pdf_text(file_path: str, targeted: bool = True) -> Iterator[str]:
+    """pdfのテキストを1ページずつ返す
 
-def read_pdf(file_path: str) -> str:
+    targetedならPart I.Aの範囲だけを読み、PART I.Bが出たページで止める。
+    しおりや目印が無ければ全ページを読む。
+    Args:
+        file_path(str): pdfのファイルパス
+        targeted(bool): Part I.Aだけを読む
+    Returns:
+        text(Iterator[str]): 各ページのテキストデータ
+    """
+    with fitz.open(file_path) as doc:
+        rect = fitz.Rect(*CLIP_RECT)  # 読み取り範囲の設定
+        start, end = find_part_ia_pages(doc) if targeted else (0, None)
+        end = doc.page_count if end is None else min(end, doc.page_count)
+
+        seen_issuer = False
+        for i in range(start, end):
+            page = doc.load_page(i)
+            text = page.get_text("text", clip=rect).replace("\n", "")
+            inc("pdf_pages_read")
+            yield text
+
+            if targeted:
+                # 目次のPART I.Bで止まらないように、Issuerが出てから判定する
+                seen_issuer = seen_issuer or "Issuer " in text
+                if seen_issuer and PART_IB.search(text):
+                    return
+
+
+def read_pdf(file_path: str, targeted: bool = True) -> str:
     """pdfの読み取り
     Args:
         file_path(str): pdfのファイルパス
+        targeted(bool): Part I.Aだけを読む（Falseなら全ページ）
     Returns:
         text(str): pdfのテキストデータ
     """
     print("parsing...", file_path)
-    doc = fitz.open(file_path)
-    rect = fitz.Rect(0, 0, 612, 745)  # 読み取り範囲の設定
+    with timer("extract_seconds", mode="targeted" if targeted else "full"):
+        text = "".join(iter_pdf_text(file_path, targeted))
 
-    texts = []
-    for i in range(doc.page_count):
-        page = doc.load_page(i)
-        texts.append(page.get_text("text", clip=rect).replace("\n", ""))
-
-    text = "".join(texts)
+    if targeted and "Issuer " not in text:
+        # しおりのページがずれている場合などは全ページを読み直す
+        inc("extract_fallbacks")
+        with timer("extract_seconds", mode="full"):
+            text = "".join(iter_pdf_text(file_path, targeted=False))
 
     return text
 
 
-def parse_pdf(row: Any, text: str) -> pd.DataFrame:
+def parse_pdf(row: Any, text: str) -> Optional[pd.DataFrame]:
     """pdfのパース
     Args:
         row(Pandas): linksテーブルの行データ
         text(str): pdfのテキストデータ
     Returns:
         details(DataFrame): パース後のdf（reportsテーブルの様式）
+            項目が欠けていたIssuerは details.attrs["warnings"] に記録
     """
-    issuers_and_industries = re.findall(r"(Issuer [A-W].*?)Type", text)
-    # -> ['Issuer A) and industry...', 'Issuer B...', ...]
-
-    if issuers_and_industries:
-        if issuers_and_industries[0]:
-            issuer_a = re.search(r"Issuer A[^)].*", issuers_and_industries[0])
-            issuer_a = (
-                "Issuer A" if issuer_a is None else issuer_a.group()  # type: ignore
-            )
-            issuers_and_industries[0] = issuer_a
-            # -> ['Issuer A – Health Care', 'Issuer B – Information Technology', ...]
-
-        issuers = [
-            re.search(r"(Issuer [A-W])", iss).group(1)  # type: ignore
-            for iss in issuers_and_industries
-        ]
-        # -> ['Issuer A', 'Issuer B', ...]
+    with timer("parse_seconds"):
+        records = tokenize_part_ia(text)
+    # -> [IssuerRecord(issuer='Issuer A', industry='Health Care', ...), ...]
+    inc("issuers", len(records))
 
-        industries = [
-            re.search(r"– (.*)", iss).group(1)  # type: ignore
-            if re.search(r"– (.*)", iss)
-            else "None"
-            for iss in issuers_and_industries
-        ]
-        # ゆらぎ修正
-        industries = [
-            "Health Care" if iss == "Healthcare" else iss for iss in industries
+    if not records:
+        return None
+
+    # df作成
+    details = pd.DataFrame(
+        [
+            {
+                "issuer": record.issuer,
+                "industry": record.industry,
+                "type_of_audit_and_related_area_affected": (
+                    record.type_of_audit_and_related_area_affected
+                ),
+                "description_of_the_deficiencies_identified": (
+                    record.description_of_the_deficiencies_identified
+                ),
+            }
+            for record in records
         ]
-        # -> ['Health Care', 'Information Technology', ...]
+    )
+    details["file_name"] = row.file_name
 
-        type_of_audit_and_related_area_affected = re.findall(
-            r"(In our review.*?)Description", text
-        )
-        # -> ['In our review, ...', 'In our review of...', ...]
+    # 主キー作成
+    details["file_name_issuer"] = details["file_name"] + "_" + details["issuer"]
 
-        description_of_the_deficiencies_identified = re.findall(
-            r"Description of the (?:deficiencies|deficiency) identified(.*?)"
-            + r"(?:Issuer|Audits with|PART I\.B|Part I\.B)",
-            text,
-        )
-        # -> ['With respect to...', ''With respect to...', ...]
-
-        # df作成
-        details = pd.DataFrame(issuers, columns=["issuer"])
-        details["industry"] = industries
-        details[
-            "type_of_audit_and_related_area_affected"
-        ] = type_of_audit_and_related_area_affected
-        details[
-            "description_of_the_deficiencies_identified"
-        ] = description_of_the_deficiencies_identified
-        details["file_name"] = row.file_name
-
-        # 前後から空白を削除
-        details["issuer"] = details["issuer"].str.strip()
-        details["industry"] = details["industry"].str.strip()
-        details["type_of_audit_and_related_area_affected"] = details[
-            "type_of_audit_and_related_area_affected"
-        ].str.strip()
-        details["description_of_the_deficiencies_identified"] = details[
-            "description_of_the_deficiencies_identified"
-        ].str.strip()
-
-        # 主キー作成
-        details["file_name_issuer"] = details["file_name"] + "_" + details["issuer"]
-
-        return details
+    # 位置ずれさせずに、欠けた項目として記録
+    details.attrs["warnings"] = [
+        f"{record.issuer}: {warning}"
+        for record in records
+        for warning in record.warnings
+    ]
+
+    return details
+
+
+def text_cache_key(sha256: str, targeted: bool = True) -> str:
+    """テキストキャッシュのキー（pdfのハッシュ + 抽出設定）
+    Args:
+        sha256(str): pdfのSHA-256
+        targeted(bool): Part I.Aだけを読んだか
+    Returns:
+        key(str): キャッシュキー
+    """
+    settings = f"{EXTRACTOR_VERSION}|{CLIP_RECT}|{targeted}"
+    digest = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+
+    return f"{sha256}:{digest}"
+
+
+def read_and_parse_pdf(
+    row: Any, folder_path: str = PDF_DIR, targeted: bool = True
+) -> Tuple[Any, Optional[pd.DataFrame], Optional[str]]:
+    """pdfの読み取りとパース（ProcessPoolExecutorのworker用）
+    Args:
+        row(SimpleNamespace): linksテーブルの行データ
+        folder_path(str): pdfの格納先
+        targeted(bool): Part I.Aだけを読む（Falseなら全ページ）
+    Returns:
+        row(SimpleNamespace): Argsのrow（新しく読み取った場合はrow.textに格納、
+            子プロセスで実行した場合は計測値をrow.metricsに格納）
+        details(DataFrame): パース後のdf（Part I.AのIssuerが無ければNone）
+        error(str): エラーメッセージ（正常終了ならNone）
+    """
+    file_path = os.path.join(folder_path, row.file_name)
+
+    details, error = None, None
+    with METRICS.profiled("parse"):
+        try:
+            # キャッシュ済みのテキストがあればpdfは開かない
+            text = getattr(row, "text", None)
+            if text is None:
+                text = read_pdf(file_path, targeted)
+                row.text = text
+                row.extracted = True
+            details = parse_pdf(row, text)
+            if details is not None:
+                row.warnings = details.attrs.get("warnings", [])
+                inc("parse_warnings", len(row.warnings))
+        except Exception as e:
+            inc("parse_failures")
+            details, error = None, f"{type(e).__name__}: {e}"
+
+    if in_worker_process():
+        # 子プロセスの計測値は親プロセスに返して合算する
+        row.metrics = METRICS.drain()
+        METRICS.dump_profiles()
+
+    return row, details, error
@@ -0,0 +1,101 @@
+"""reportsの全文検索（SQLite FTS5）
+
+reports_ftsはreportsのトリガーで同期している（backend/migrations.pyのv3）。
+検索語はFTS5のクエリ構文（"フレーズ" / 前方一致* / AND OR NOT）をそのまま使い、
+構文として解釈できなければ単語ごとのフレーズ検索（AND）にする。
+"""
+import re
+from typing import Any, Dict
+
+import pandas as pd
+from sqlalchemy import text as sql_text
+from sqlalchemy.exc import OperationalError
+
+# 一致した語の前後に付ける文字（本文に出てこない制御文字、表示側で強調に置き換える）
+HIGHLIGHT = ("\x02", "\x03")
+SNIPPET_TOKENS = 64  # スニペットの長さ（トークン数、FTS5の上限は64）
+SNIPPET_COLUMNS = [
+    "type_of_audit_and_related_area_affected",
+    "description_of_the_deficiencies_identified",
+]
+
+SEARCH_SQL = sql_text(
+    """
+SELECT
+    file_name_issuer,
+    bm25(reports_fts) AS rank
+FROM reports_fts
+WHERE reports_fts MATCH :query
+ORDER BY rank
+"""
+)
+
+# 選択した1行のスニペット（reports_fts_rowidでrowidを引く）
+SNIPPET_SQL = sql_text(
+    """
+SELECT
+    snippet(reports_fts, 0, :open, :close, '…', :tokens)
+        AS type_of_audit_and_related_area_affected,
+    snippet(reports_fts, 1, :open, :close, '…', :tokens)
+        AS description_of_the_deficiencies_identified
+FROM reports_fts
+WHERE reports_fts MATCH :query
+    AND rowid = (
+        SELECT id FROM reports_fts_rowid WHERE file_name_issuer = :file_name_issuer
+    )
+"""
+)
+
+
+def quote_query(text: str) -> str:
+    """単語ごとにフレーズとして囲む（記号を含む語もそのまま探せる）
+    Args:
+        text(str): 検索語
+    Returns:
+        query(str): FTS5のクエリ
+    """
+    words = re.findall(r"\S+", text)
+
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _read_match(bind: Any, sql: Any, text: str, params: Dict[str, Any]) -> pd.DataFrame:
+    """MATCHのクエリを実行（構文として解釈できなければフレーズ検索にする）"""
+    try:
+        return pd.read_sql(sql, bind, params=dict(params, query=text))
+    except OperationalError:
+        # fts5: syntax error など（10-K / ICFR: / 閉じていない"）
+        return pd.read_sql(sql, bind, params=dict(params, query=quote_query(text)))
+
+
+def search_reports(bind: Any, text: str) -> pd.DataFrame:
+    """全文検索（関連度順、件数で切らずに全て返す。サイドバーの絞り込みは呼び出し側で結合する）
+    Args:
+        bind(Engine): DBのエンジン
+        text(str): 検索語（FTS5のクエリ構文）
+    Returns:
+        df(pd.DataFrame): file_name_issuer / rank（小さいほど関連度が高い）
+    """
+    return _read_match(bind, SEARCH_SQL, text, {})
+
+
+def search_snippets(bind: Any, text: str, file_name_issuer: str) -> Dict[str, str]:
+    """1行分のスニペット（一致した語をHIGHLIGHTで囲む）
+    Args:
+        bind(Engine): DBのエンジン
+        text(str): 検索語（search_reportsと同じ）
+        file_name_issuer(str): reportsの主キー
+    Returns:
+        snippets(Dict[str, str]): 列名 -> スニペット（一致しなければ空）
+    """
+    params = {
+        "open": HIGHLIGHT[0],
+        "close": HIGHLIGHT[1],
+        "tokens": SNIPPET_TOKENS,
+        "file_name_issuer": file_name_issuer,
+    }
+    df = _read_match(bind, SNIPPET_SQL, text, params)
+    if df.empty:
+        return {}
+
+    return {column: df.iloc[0][column] for column in SNIPPET_COLUMNS}
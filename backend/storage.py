@@ -0,0 +1,350 @@
+import datetime
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection, Engine
+
+from backend.metrics import inc, profiled, timer
+from backend.models import DataVersion, Link, Report, ReportRollup, TextCache
+
+# 1回のSELECT ... INで渡すキーの数（SQLiteの変数上限対策）
+CHUNK_SIZE = 500
+
+# テキストキャッシュの上限（圧縮後のバイト数）
+TEXT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 同じレポートの版の見分け方（104-2021-175 / 104-2021-175a / 104-2021-175-expanded）
+REPORT_BASE = re.compile(r"(\d{3}-\d{4}-\d{3})(a?)")
+REVISION_A = 1
+REVISION_EXPANDED = 2
+
+
+class UpsertResult(NamedTuple):
+    """bulk_upsertの結果"""
+
+    inserted: int
+    updated: int
+    skipped: int
+
+
+def _clean(value: Any) -> Any:
+    """NaN/NaTをNoneにそろえる"""
+    if value != value:
+        return None
+    if hasattr(value, "to_pydatetime"):
+        # pandasのTimestamp -> datetime
+        return value.to_pydatetime()
+
+    return value
+
+
+def bulk_upsert(
+    bind: Any,
+    model: Any,
+    records: Iterable[Dict[Any, Any]],
+    index_elements: Optional[Sequence[str]] = None,
+    update: bool = True,
+) -> UpsertResult:
+    """まとめてINSERT ... ON CONFLICT（1トランザクション）
+    Args:
+        bind(Engine|Connection): 書き込み先（Connectionなら呼び出し側のトランザクション）
+        model(Base): 書き込むテーブルのモデル
+        records(Iterable[Dict]): 書き込む行
+        index_elements(Sequence[str]): 重複判定に使う列（省略時は主キー）
+        update(bool): 既存行の値が違えば更新する（Falseならスキップ）
+    Returns:
+        result(UpsertResult): inserted / updated / skipped の件数
+    """
+    table = model.__table__
+    if isinstance(bind, Engine):
+        with profiled("db"), timer("db_transaction_seconds", table=table.name):
+            with bind.begin() as conn:
+                return bulk_upsert(conn, model, records, index_elements, update)
+
+    conn: Connection = bind  # type: ignore
+    if index_elements is None:
+        index_elements = [column.name for column in table.primary_key.columns]
+    key_columns = [table.c[name] for name in index_elements]
+
+    # 同じキーはバッチ内で後勝ち
+    batch: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for record in records:
+        row = {name: _clean(value) for name, value in record.items() if name in table.c}
+        batch[tuple(row[name] for name in index_elements)] = row
+
+    if not batch:
+        return UpsertResult(0, 0, 0)
+
+    columns = list(next(iter(batch.values())))
+    update_columns = [
+        name
+        for name in columns
+        if name not in index_elements and not table.c[name].primary_key
+    ]
+
+    # 既存行を取得して inserted / updated / skipped に分ける
+    existing: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    keys = list(batch)
+    for i in range(0, len(keys), CHUNK_SIZE):
+        end = i + CHUNK_SIZE
+        chunk = keys[i:end]
+        if len(key_columns) == 1:
+            where = key_columns[0].in_([key[0] for key in chunk])
+        else:
+            where = tuple_(*key_columns).in_(chunk)
+        for row in conn.execute(select(table).where(where)).mappings():
+            existing[tuple(row[name] for name in index_elements)] = dict(row)
+
+    writes: List[Dict[str, Any]] = []
+    inserted = updated = skipped = 0
+    for key, row in batch.items():
+        current = existing.get(key)
+        if current is None:
+            inserted += 1
+        elif update and any(current[name] != row[name] for name in update_columns):
+            updated += 1
+        else:
+            skipped += 1
+            continue
+        writes.append(row)
+
+    inc("db_rows_skipped", skipped, table=table.name)
+    if writes:
+        inc("db_rows_written", len(writes), table=table.name)
+        stmt = insert(table)
+        if update and update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(index_elements),
+                set_={name: stmt.excluded[name] for name in update_columns},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(index_elements))
+        with timer("db_write_seconds", table=table.name):
+            conn.execute(stmt, writes)
+
+    return UpsertResult(inserted, updated, skipped)
+
+
+def report_revision(pdf_url: str) -> Dict[str, Any]:
+    """pdfのURLからレポート番号と版の新しさを求める
+    Args:
+        pdf_url(str): pdfのURL
+    Returns:
+        revision(Dict): report_base（番号が無ければNone）とrevision_rank
+    """
+    match = REPORT_BASE.search(pdf_url)
+    if match is None:
+        return {"report_base": None, "revision_rank": 0}
+
+    rank = REVISION_EXPANDED if "-expanded.pdf" in pdf_url else 0
+    if match.group(2):
+        rank += REVISION_A
+
+    return {"report_base": match.group(1), "revision_rank": rank}
+
+
+def upsert_links(bind: Any, records: Iterable[Dict[Any, Any]]) -> UpsertResult:
+    """linksにまとめて書き込み（file_nameで重複判定、版の情報も付ける）"""
+    records = (dict(record, **report_revision(record["pdf_url"])) for record in records)
+
+    return bulk_upsert(bind, Link, records, index_elements=["file_name"])
+
+
+def upsert_reports(bind: Any, records: Iterable[Dict[Any, Any]]) -> UpsertResult:
+    """reportsにまとめて書き込み（file_name_issuerで重複判定）"""
+    return bulk_upsert(bind, Report, records)
+
+
+def delete_stale_reports(bind: Any, file_name: str, keep: Sequence[str]) -> int:
+    """パースし直したpdfのreportsのうち、今回のパース結果に無い行を削除
+    Args:
+        bind(Engine|Connection): 書き込み先（Connectionなら呼び出し側のトランザクション）
+        file_name(str): pdfのファイル名
+        keep(Sequence[str]): 今回のパース結果のfile_name_issuer（空なら全て削除）
+    Returns:
+        deleted(int): 削除した件数
+    """
+    table = Report.__table__
+    stmt = delete(table).where(table.c.file_name == file_name)
+    if keep:
+        stmt = stmt.where(table.c.file_name_issuer.notin_(list(keep)))
+    deleted = bind.execute(stmt).rowcount
+    inc("db_rows_deleted", deleted, table=table.name)
+
+    return deleted
+
+
+def get_data_version(bind: Any, name: str = "reports") -> Tuple[int, int]:
+    """reportsのデータのバージョン（トリガーで更新、毎回読んでも軽い）
+    Args:
+        bind(Engine|Connection): 読み込み先
+        name(str): "reports" / "report_rollup"（集計したときのreportsのバージョン）
+    Returns:
+        version(Tuple[int, int]): version（変更のたびに+1）とgeneration（更新・削除で+1）
+    """
+    table = DataVersion.__table__
+    row = bind.execute(
+        select(table.c.version, table.c.generation).where(table.c.name == name)
+    ).first()
+    if row is None:
+        return 0, 0
+
+    return row.version, row.generation
+
+
+def refresh_rollup(bind: Any) -> int:
+    """report_rollupをcanonical_reportsから集計し直す（取り込みの最後に実行）
+    Args:
+        bind(Engine|Connection): 書き込み先
+    Returns:
+        rows(int): 集計後の行数
+    """
+    if isinstance(bind, Engine):
+        with profiled("db"), timer("db_transaction_seconds", table="report_rollup"):
+            with bind.begin() as conn:
+                return refresh_rollup(conn)
+
+    table = ReportRollup.__table__
+    bind.execute(delete(table))
+    bind.exec_driver_sql(
+        """
+        INSERT INTO report_rollup (
+            report_date, report_month, firm_name, country, industry, issuers
+        )
+        SELECT
+            report_date,
+            substr(report_date, 1, 7),
+            firm_name,
+            country,
+            industry,
+            COUNT(*)
+        FROM canonical_reports
+        GROUP BY report_date, firm_name, country, industry
+        """
+    )
+    # どのバージョンのreportsを集計したか（同じトランザクションで記録）
+    bind.exec_driver_sql(
+        """
+        INSERT OR REPLACE INTO data_version (name, version, generation)
+        SELECT 'report_rollup', version, generation FROM data_version
+        WHERE name = 'reports'
+        """
+    )
+
+    return bind.execute(select(func.count()).select_from(table)).scalar()
+
+
+def get_cached_texts(bind: Any, keys: Sequence[str]) -> Dict[str, str]:
+    """テキストキャッシュから取得（last_used_atも更新）
+    Args:
+        bind(Engine|Connection): 読み込み先
+        keys(Sequence[str]): キャッシュキー
+    Returns:
+        texts(Dict[str, str]): キャッシュキー -> テキスト（ヒットしたものだけ）
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            return get_cached_texts(conn, keys)
+
+    table = TextCache.__table__
+    texts = {}
+    for i in range(0, len(keys), CHUNK_SIZE):
+        end = i + CHUNK_SIZE
+        chunk = keys[i:end]
+        rows = bind.execute(
+            select(table.c.cache_key, table.c.text).where(table.c.cache_key.in_(chunk))
+        )
+        for cache_key, text in rows:
+            texts[cache_key] = zlib.decompress(text).decode("utf-8")
+
+        bind.execute(
+            update(table)
+            .where(table.c.cache_key.in_(chunk))
+            .values(last_used_at=datetime.datetime.now())
+        )
+
+    return texts
+
+
+def put_cached_text(bind: Any, cache_key: str, file_name: str, text: str) -> None:
+    """テキストキャッシュに保存
+    Args:
+        bind(Engine|Connection): 書き込み先
+        cache_key(str): キャッシュキー
+        file_name(str): pdfのファイル名
+        text(str): 抽出したテキスト
+    """
+    data = zlib.compress(text.encode("utf-8"))
+    now = datetime.datetime.now()
+    bulk_upsert(
+        bind,
+        TextCache,
+        [
+            {
+                "cache_key": cache_key,
+                "file_name": file_name,
+                "text": data,
+                "size": len(data),
+                "created_at": now,
+                "last_used_at": now,
+            }
+        ],
+    )
+
+
+def evict_text_cache(bind: Any, max_bytes: int = TEXT_CACHE_MAX_BYTES) -> int:
+    """合計サイズがmax_bytesに収まるまで古いものから削除
+    Args:
+        bind(Engine|Connection): 書き込み先
+        max_bytes(int): 圧縮後の合計サイズの上限
+    Returns:
+        deleted(int): 削除した件数
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            return evict_text_cache(conn, max_bytes)
+
+    table = TextCache.__table__
+    total = bind.execute(select(func.coalesce(func.sum(table.c.size), 0))).scalar()
+    if total <= max_bytes:
+        return 0
+
+    # 最後に使った日時が古い順に削除
+    evict = []
+    rows = bind.execute(
+        select(table.c.cache_key, table.c.size).order_by(table.c.last_used_at)
+    )
+    for cache_key, size in rows:
+        if total <= max_bytes:
+            break
+        evict.append(cache_key)
+        total -= size
+
+    for i in range(0, len(evict), CHUNK_SIZE):
+        end = i + CHUNK_SIZE
+        bind.execute(delete(table).where(table.c.cache_key.in_(evict[i:end])))
+
+    return len(evict)
+
+
+def invalidate_text_cache(bind: Any, file_names: Optional[Sequence[str]] = None) -> int:
+    """テキストキャッシュを削除
+    Args:
+        bind(Engine|Connection): 書き込み先
+        file_names(Sequence[str]): 削除するpdfのファイル名（省略時は全て）
+    Returns:
+        deleted(int): 削除した件数
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            return invalidate_text_cache(conn, file_names)
+
+    table = TextCache.__table__
+    stmt = delete(table)
+    if file_names is not None:
+        stmt = stmt.where(table.c.file_name.in_(list(file_names)))
+
+    return bind.execute(stmt).rowcount
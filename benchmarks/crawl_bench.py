@@ -0,0 +1,175 @@
+"""クロール・ダウンロードのスループットのベンチマーク
+
+ローカルのモックサーバー（benchmarks.mock_site）に対して
+get_last_page → get_listing（get_report）→ get_pdf を実行し、
+pages/sec、MB/sec とリトライの状況を表示する。
+ブラウザは使わない（HTTPでの取得だけを計測する）。
+
+python -m benchmarks.crawl_bench --reports 1000 --latency 0.05 --error-rate 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+
+from tenacity import wait_fixed
+
+from backend.scraper import utils
+from backend.scraper.utils import get_last_page, get_listing, get_pdf, listing_url
+from benchmarks.mock_site import add_arguments, from_args
+
+# 計測中はリトライ間隔を短くする（本番の待ち時間は計測の邪魔になる）
+RETRYING = [
+    utils.get_soup,
+    utils.get_last_page,
+    utils.get_listing,
+    utils.download_file,
+]
+
+
+def set_retry_wait(seconds: float) -> None:
+    """リトライ間隔を固定値に変更"""
+    for func in RETRYING:
+        func.retry.wait = wait_fixed(seconds)  # type: ignore
+
+
+def crawl(base_url: str, workers: int) -> Dict[str, Any]:
+    """一覧ページを全て取得
+    Args:
+        base_url(str): モックサーバーのURL
+        workers(int): 一覧ページを同時に取得する数
+    Returns:
+        result(Dict): 計測結果と取得したpdfのURL
+    """
+    start = time.perf_counter()
+    last_page = get_last_page(listing_url(base_url=base_url))
+
+    urls: List[str] = []
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(get_listing, listing_url(page, base_url))
+            for page in range(1, last_page + 1)
+        ]
+        for future in futures:
+            try:
+                urls.extend(future.result()["pdf_url"])
+            except Exception:
+                failed += 1
+    seconds = time.perf_counter() - start
+
+    return {
+        "pages": last_page,
+        "reports": len(urls),
+        "failed_pages": failed,
+        "seconds": seconds,
+        "pages_per_sec": last_page / seconds,
+        "urls": urls,
+    }
+
+
+def download(urls: List[str], workers: int) -> Dict[str, Any]:
+    """pdfを全てダウンロード
+    Args:
+        urls(List[str]): pdfのURL
+        workers(int): 同時にダウンロードする数
+    Returns:
+        result(Dict): 計測結果
+    """
+    with tempfile.TemporaryDirectory() as folder_path:
+        start = time.perf_counter()
+        records, failed = get_pdf(folder_path, urls, workers=workers)
+        seconds = time.perf_counter() - start
+
+    size = sum(record["size"] for record in records)
+
+    return {
+        "files": len(records),
+        "failed_files": len(failed),
+        "mb": size / 1024 / 1024,
+        "seconds": seconds,
+        "files_per_sec": len(records) / seconds if seconds else 0.0,
+        "mb_per_sec": size / 1024 / 1024 / seconds if seconds else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="クロール・ダウンロードのベンチマーク")
+    add_arguments(parser)
+    parser.add_argument("--workers", type=int, default=4, help="一覧ページを同時に取得する数")
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=utils.DOWNLOAD_WORKERS,
+        help="同時にダウンロードする数",
+    )
+    parser.add_argument("--pdfs", type=int, help="ダウンロードするpdfの数（省略時は全て）")
+    parser.add_argument("--retry-wait", type=float, default=0.0, help="リトライ間隔（秒）")
+    parser.add_argument("--verbose", action="store_true", help="進捗を表示する")
+    parser.add_argument("--json", help="結果をjsonで保存するパス")
+    args = parser.parse_args()
+
+    set_retry_wait(args.retry_wait)
+
+    with from_args(args) as site, open(os.devnull, "w") as devnull:
+        out = sys.stdout if args.verbose else devnull
+
+        with redirect_stdout(out):
+            listing = crawl(site.base_url, args.workers)
+        listing_stats = dict(site.stats)
+        site.reset_stats()
+
+        urls = listing.pop("urls")[: args.pdfs]
+        with redirect_stdout(out):
+            downloads = download(urls, args.download_workers)
+        download_stats = dict(site.stats)
+
+    listing.update(
+        requests=listing_stats.get("listing_requests", 0),
+        retries=listing_stats.get("retries", 0),
+        injected_errors=listing_stats.get("injected_errors", 0),
+    )
+    downloads.update(
+        requests=download_stats.get("pdf_requests", 0),
+        retries=download_stats.get("retries", 0),
+        injected_errors=download_stats.get("injected_errors", 0),
+        injected_truncations=download_stats.get("injected_truncations", 0),
+        resumed=download_stats.get("resumed", 0),
+    )
+
+    print(
+        f"listing : {listing['pages']} pages / {listing['reports']} reports"
+        + f" in {listing['seconds']:.2f}s"
+        + f" -> {listing['pages_per_sec']:.1f} pages/sec"
+    )
+    print(
+        f"          requests: {listing['requests']}, retries: {listing['retries']}"
+        + f", injected errors: {listing['injected_errors']}"
+        + f", failed pages: {listing['failed_pages']}"
+    )
+    print(
+        f"download: {downloads['files']} files / {downloads['mb']:.1f} MB"
+        + f" in {downloads['seconds']:.2f}s"
+        + f" -> {downloads['files_per_sec']:.1f} files/sec"
+        + f", {downloads['mb_per_sec']:.2f} MB/sec"
+    )
+    print(
+        f"          requests: {downloads['requests']}, retries: {downloads['retries']}"
+        + f", injected errors: {downloads['injected_errors']}"
+        + f", truncations: {downloads['injected_truncations']}"
+        + f", resumed: {downloads['resumed']}"
+        + f", failed files: {downloads['failed_files']}"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"listing": listing, "download": downloads}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
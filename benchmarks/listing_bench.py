@@ -0,0 +1,144 @@
+"""一覧ページの解析（get_report）のマイクロベンチマーク
+
+fixtures/listing に保存した一覧ページのHTMLを、
+以前の実装（ページ全体をhtml.parserで解析し、1件ずつpd.concat）と
+現在の実装（カードの要素だけを解析し、最後に1回だけDataFrame化）で解析して比べる。
+
+python -m benchmarks.listing_bench [--repeat 20]
+python -m benchmarks.listing_bench --save  # モックサーバーの一覧ページを保存し直す
+"""
+import argparse
+import datetime
+import glob
+import os
+import re
+import time
+from typing import Callable, List
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from backend.scraper import utils
+from backend.scraper.utils import REPORT_COLUMNS, REPORT_SELECTOR, get_report, make_soup
+from benchmarks.make_fixtures import FIXTURES_DIR
+
+LISTING_DIR = os.path.join(FIXTURES_DIR, "listing")
+
+
+def legacy_get_report(html: str) -> pd.DataFrame:
+    """以前の実装（比較用）"""
+    soup = BeautifulSoup(html, "html.parser")
+    df = pd.DataFrame(columns=["firm_name", "country", "report_date", "pdf_url"])
+    for tag in soup.find_all(class_="media-body sf-media-body"):
+        firm_name = tag.find("a").get_text()
+        country_and_report_date = tag.find_all(class_="lead-text-st")
+        country = country_and_report_date[0].get_text()
+        report_date = country_and_report_date[-1].get_text().replace(".", "")
+        report_date = datetime.datetime.strptime(report_date, "%b %d, %Y")
+        report_date = datetime.date(
+            report_date.year, report_date.month, report_date.day
+        )
+        pdf_url = tag.find("a").get("href")
+        tmp = pd.DataFrame(
+            {
+                "firm_name": [firm_name],
+                "country": [country],
+                "report_date": [report_date],
+                "pdf_url": [pdf_url],
+            }
+        )
+        df = pd.concat([df, tmp], ignore_index=True)
+
+    df["file_name"] = df["pdf_url"].apply(
+        lambda x: re.search(r"\/[^\/]*pdf", x).group().replace("/", "")  # type: ignore
+    )
+
+    return df
+
+
+def current_get_report(html: str) -> pd.DataFrame:
+    """現在の実装（get_listingと同じ処理）"""
+    records = get_report(make_soup(html, REPORT_SELECTOR))
+
+    return pd.DataFrame.from_records(records, columns=REPORT_COLUMNS)
+
+
+def best_of(func: Callable[[], pd.DataFrame], repeat: int) -> float:
+    """実行時間の最小値（ミリ秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def save_listing(reports: int = 96 * 3) -> List[str]:
+    """モックサーバーの一覧ページをfixtures/listingに保存"""
+    from benchmarks.mock_site import MockSite
+
+    site = MockSite(reports=reports)
+    site.server.server_close()
+
+    os.makedirs(LISTING_DIR, exist_ok=True)
+    paths = []
+    for per_page in [12, 96]:
+        file_path = os.path.join(LISTING_DIR, f"listing_{per_page}.html")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(site.listing(1, per_page))
+        paths.append(file_path)
+
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="一覧ページの解析のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=20, help="計測の繰り返し回数")
+    parser.add_argument("--save", action="store_true", help="一覧ページを保存し直す")
+    args = parser.parse_args()
+
+    if args.save:
+        for path in save_listing():
+            print("saved:", path)
+        return
+
+    parsers = ["html.parser"]
+    if utils.HTML_PARSER != "html.parser":
+        parsers.append(utils.HTML_PARSER)
+
+    header = f"{'file':<20}{'cards':>6}{'KB':>7}{'legacy':>11}" + "".join(
+        f"{name:>20}" for name in parsers
+    )
+    print(header)
+    print("-" * len(header))
+
+    default_parser = utils.HTML_PARSER
+    for path in sorted(glob.glob(os.path.join(LISTING_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        expected = legacy_get_report(html)
+        legacy_ms = best_of(lambda: legacy_get_report(html), args.repeat)
+
+        times = []
+        try:
+            for name in parsers:
+                utils.HTML_PARSER = name
+                # 以前の実装と同じ結果になること
+                pd.testing.assert_frame_equal(
+                    current_get_report(html), expected, check_dtype=False
+                )
+                times.append(best_of(lambda: current_get_report(html), args.repeat))
+        finally:
+            utils.HTML_PARSER = default_parser
+
+        print(
+            f"{os.path.basename(path):<20}{len(expected):>6}{len(html) / 1024:>7.0f}"
+            + f"{legacy_ms:>9.2f}ms"
+            + "".join(f"{ms:>9.2f}ms (x{legacy_ms / ms:>5.1f})" for ms in times)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""ベンチマーク用のフィクスチャ作成
+
+fixtures/cases/*.txt（抽出テキストのサンプル）から合成pdfを作成する。
+  - "\\f" だけの行で改ページ
+  - "## タイトル" の行はそのページのしおり（TOC）になる（本文には出さない）
+
+python -m benchmarks.make_fixtures           # pdfを作り直す
+python -m benchmarks.make_fixtures --golden  # 現在のパーサーの出力で正解データを作り直す
+"""
+import argparse
+import glob
+import json
+import os
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import fitz
+
+from backend.scraper.utils import parse_pdf
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CASES_DIR = os.path.join(FIXTURES_DIR, "cases")
+PDF_DIR = os.path.join(FIXTURES_DIR, "pdf")
+GOLDEN_DIR = os.path.join(FIXTURES_DIR, "golden")
+
+PAGE_BREAK = "\\f"
+FONT_NAME = "china-s"  # "–" を含むUnicodeを埋め込みなしで出せる組み込みフォント
+FONT_SIZE = 6  # 長い行はCLIP_RECTからはみ出さないように縮める
+LINE_HEIGHT = 8
+MARGIN = 36
+
+Page = Tuple[Optional[str], List[str]]
+
+
+def case_names() -> List[str]:
+    """フィクスチャの名前一覧"""
+    paths = sorted(glob.glob(os.path.join(CASES_DIR, "*.txt")))
+
+    return [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+
+def load_case(name: str) -> List[Page]:
+    """フィクスチャのテキストをページごとに読み込む
+    Args:
+        name(str): フィクスチャの名前
+    Returns:
+        pages(List[Page]): (しおりのタイトル, 行のリスト) のリスト
+    """
+    with open(os.path.join(CASES_DIR, name + ".txt"), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+
+    pages: List[Page] = []
+    title: Optional[str] = None
+    body: List[str] = []
+    for line in lines:
+        if line == PAGE_BREAK:
+            pages.append((title, body))
+            title, body = None, []
+        elif line.startswith("## "):
+            title = line[3:]
+        else:
+            body.append(line)
+    pages.append((title, body))
+
+    return pages
+
+
+def case_text(name: str) -> str:
+    """read_pdfと同じ形（改行なしで連結）のテキスト"""
+    return "".join("".join(body) for _, body in load_case(name))
+
+
+def make_pdf(name: str) -> str:
+    """フィクスチャのpdfを作成
+    Args:
+        name(str): フィクスチャの名前
+    Returns:
+        file_path(str): 作成したpdfのパス
+    """
+    doc = fitz.open()
+    toc = []
+    for i, (title, body) in enumerate(load_case(name)):
+        page = doc.new_page(width=612, height=792)
+        # 折り返すと単語が連結されてしまうので1行ずつ置く
+        width = page.rect.width - MARGIN * 2
+        for j, line in enumerate(body):
+            length = fitz.get_text_length(line, fontname=FONT_NAME, fontsize=FONT_SIZE)
+            fontsize = (
+                min(FONT_SIZE, FONT_SIZE * width / length) if length else FONT_SIZE
+            )
+            point = fitz.Point(MARGIN, MARGIN + LINE_HEIGHT * (j + 1))
+            page.insert_text(point, line, fontname=FONT_NAME, fontsize=fontsize)
+        if title is not None:
+            toc.append([1, title, i + 1])
+    doc.set_toc(toc)
+
+    os.makedirs(PDF_DIR, exist_ok=True)
+    file_path = os.path.join(PDF_DIR, name + ".pdf")
+    doc.save(file_path, garbage=4, deflate=True)
+    doc.close()
+
+    return file_path
+
+
+def make_golden(name: str) -> str:
+    """現在のパーサーの出力を正解データとして保存
+    Args:
+        name(str): フィクスチャの名前
+    Returns:
+        file_path(str): 作成したjsonのパス
+    """
+    details = parse_pdf(SimpleNamespace(file_name=name + ".pdf"), case_text(name))
+    records = [] if details is None else details.to_dict("records")
+
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    file_path = os.path.join(GOLDEN_DIR, name + ".json")
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+    return file_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ベンチマーク用のフィクスチャ作成")
+    parser.add_argument("--golden", action="store_true", help="正解データ（golden）も作り直す")
+    args = parser.parse_args()
+
+    for name in case_names():
+        print(make_pdf(name))
+        if args.golden:
+            print(make_golden(name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""PCAOBサイトの代わりになるローカルのモックサーバー
+
+一覧ページ（.media-body.sf-media-body / .hawk-pagination__total-text）と
+pdf本体を返す。遅延と障害（503 / 途中切断）を注入できる。
+pdfの中身は fixtures/pdf の合成pdfを順番に使う（size指定があれば末尾を埋める）。
+
+python -m benchmarks.mock_site --port 8000 --latency 0.05 --error-rate 0.1
+FIR_BASE_URL=http://127.0.0.1:8000 python -m backend.scraper.get_page_detail
+"""
+import argparse
+import datetime
+import email.utils
+import glob
+import hashlib
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from backend.scraper.utils import LISTING_PATH
+from benchmarks.make_fixtures import PDF_DIR
+
+PDF_PATH = "/docs/default-source/inspections/reports"
+FIRMS = [
+    "Baker Newman & Noyes, P.A. Limited Liability Company",
+    "Deloitte & Touche LLP",
+    "Ernst & Young LLP",
+    "KPMG AG Wirtschaftsprüfungsgesellschaft",
+    "PricewaterhouseCoopers LLP",
+    "Grant Thornton LLP",
+    "BDO USA, LLP",
+    "Marcum LLP",
+]
+COUNTRIES = ["United States", "Germany", "Japan", "United Kingdom", "Canada"]
+
+# 実際のページと同じく、一覧の前後にナビゲーションやスクリプトを置く
+NAV = "\n".join(
+    f'<li class="nav-item"><a class="nav-link" href="/section/{i}">Section {i}</a></li>'
+    for i in range(300)
+)
+SCRIPT = "<script>" + "var config = {{}};\n" * 2000 + "</script>"  # formatで{}になる
+LISTING_TEMPLATE = (
+    """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Firm Inspection Reports</title>
+"""
+    + SCRIPT
+    + """
+</head>
+<body>
+<header><nav><ul class="nav">
+"""
+    + NAV
+    + """
+</ul></nav></header>
+<div class="hawk-results">
+{items}
+</div>
+<div class="hawk-pagination">
+<span class="hawk-pagination__total-text">of {last_page}</span>
+</div>
+<footer><ul class="nav">
+"""
+    + NAV
+    + """
+</ul></footer>
+</body></html>
+"""
+)
+ITEM_TEMPLATE = """<div class="media">
+<div class="media-body sf-media-body">
+<h3><a href="{pdf_url}">{firm_name}</a></h3>
+<div class="lead-text-st">{country}</div>
+<div class="lead-text-st">{report_date}</div>
+</div>
+</div>"""
+
+
+class MockSite:
+    """モックサーバー本体
+
+    reports件のレポートを新しい順に一覧ページに載せる（1ページの件数はmppで指定）。
+    latencyは1リクエストごとの待ち時間（秒）、error_rateは503を返す割合、
+    truncate_rateはpdfを途中で切断する割合。
+    """
+
+    def __init__(
+        self,
+        reports: int = 500,
+        per_page: int = 96,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        pdf_size: Optional[int] = None,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Counter = Counter()
+        self._requested: Dict[str, int] = Counter()
+
+        handler = type("Handler", (_Handler,), {"site": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+        self.reports = self._make_reports(reports, seed)
+        self.pdfs = self._make_pdfs(pdf_size)
+        self._pdf_index = {report["path"]: i for i, report in enumerate(self.reports)}
+
+    @property
+    def base_url(self) -> str:
+        """サーバーのURL（FIR_BASE_URLに渡す）"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_reports(self, count: int, seed: int) -> List[Dict[str, str]]:
+        """レポート一覧（新しい順）を作成"""
+        rand = random.Random(seed)
+        date = datetime.date(2022, 9, 30)
+        reports = []
+        for i in range(count):
+            date -= datetime.timedelta(days=rand.randint(0, 3))
+            # -> 'May 26, 2022' / 'Apr. 5, 2022'
+            month = date.strftime("%b") + ("." if date.month != 5 else "")
+            reports.append(
+                {
+                    "firm_name": rand.choice(FIRMS),
+                    "country": rand.choice(COUNTRIES),
+                    "report_date": f"{month} {date.day}, {date.year}",
+                    "path": f"{PDF_PATH}/{date.year}/104-{date.year}-{i:04d}.pdf",
+                }
+            )
+
+        return reports
+
+    def _make_pdfs(self, size: Optional[int]) -> List[bytes]:
+        """配信するpdfの本体（size指定があれば末尾を埋める）"""
+        pdfs = []
+        for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+            with open(path, "rb") as f:
+                data = f.read()
+            if size is not None and len(data) < size:
+                # %%EOFの後ろのコメントは読み飛ばされる
+                data += b"\n%" + b"0" * (size - len(data) - 2)
+            pdfs.append(data)
+
+        return pdfs
+
+    def pdf_body(self, path: str) -> Optional[bytes]:
+        """pdfのパスから本体を取得"""
+        i = self._pdf_index.get(path)
+        if i is None:
+            return None
+
+        return self.pdfs[i % len(self.pdfs)]
+
+    def listing(self, page: int, per_page: int) -> str:
+        """一覧ページのHTML"""
+        start = (page - 1) * per_page
+        end = start + per_page
+        items = [
+            ITEM_TEMPLATE.format(
+                pdf_url=self.base_url + report["path"],
+                firm_name=report["firm_name"],
+                country=report["country"],
+                report_date=report["report_date"],
+            )
+            for report in self.reports[start:end]
+        ]
+        last_page = max(1, -(-len(self.reports) // per_page))
+
+        return LISTING_TEMPLATE.format(items="\n".join(items), last_page=last_page)
+
+    def inject(self, kind: str) -> Optional[str]:
+        """このリクエストに注入する障害（無ければNone）"""
+        with self._lock:
+            value = self._random.random()
+        if value < self.error_rate:
+            return "error"
+        if kind == "pdf" and value < self.error_rate + self.truncate_rate:
+            return "truncate"
+
+        return None
+
+    def count(self, key: str, value: int = 1) -> None:
+        """統計を加算"""
+        with self._lock:
+            self.stats[key] += value
+
+    def count_request(self, path: str) -> None:
+        """同じURLへの2回目以降のリクエストをリトライとして数える"""
+        with self._lock:
+            self._requested[path] += 1
+            if self._requested[path] > 1:
+                self.stats["retries"] += 1
+
+    def reset_stats(self) -> None:
+        """統計をリセット"""
+        with self._lock:
+            self.stats.clear()
+            self._requested.clear()
+
+    def start(self) -> "MockSite":
+        """別スレッドでサーバーを起動"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        """サーバーを停止"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockSite":
+        return self.start()
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """MockSiteのリクエストハンドラ"""
+
+    site: MockSite
+    protocol_version = "HTTP/1.1"  # keep-aliveを有効にする
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # アクセスログは出さない
+        pass
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if self.site.latency:
+            time.sleep(self.site.latency)
+
+        if url.path.rstrip("/") == LISTING_PATH:
+            kind = "listing"
+        elif url.path.endswith(".pdf"):
+            kind = "pdf"
+        else:
+            self.send_error(404)
+            return
+
+        self.site.count(kind + "_requests")
+        self.site.count_request(self.path)
+        fault = self.site.inject(kind)
+        if fault == "error":
+            self.site.count("injected_errors")
+            self.send_error(503)
+            return
+
+        if kind == "listing":
+            page = int(query.get("pg", ["1"])[0])
+            per_page = int(query.get("mpp", [str(self.site.per_page)])[0])
+            self._send_listing(page, per_page)
+        else:
+            body = self.site.pdf_body(url.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self._send_pdf(body, truncate=(fault == "truncate"))
+
+    def _send_listing(self, page: int, per_page: int) -> None:
+        """一覧ページを返す"""
+        body = self.site.listing(page, per_page).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.site.count("bytes_sent", len(body))
+
+    def _send_pdf(self, body: bytes, truncate: bool) -> None:
+        """pdfを返す（Range / 条件付きGET対応）"""
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'  # nosec
+        last_modified = email.utils.formatdate(0, usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self.site.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        start, status = 0, 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-")[0] or 0)
+            if start >= len(body):
+                self.send_error(416)
+                return
+            status = 206
+            self.site.count("resumed")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.end_headers()
+
+        data = body[start:]
+        if truncate:
+            # 半分だけ送って切断
+            data = data[: len(data) // 2]
+            self.site.count("injected_truncations")
+            self.close_connection = True
+        self.wfile.write(data)
+        self.site.count("bytes_sent", len(data))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """MockSiteの設定の引数を追加（crawl_benchと共通）"""
+    parser.add_argument("--reports", type=int, default=500, help="レポート数")
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストの遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す割合")
+    parser.add_argument(
+        "--truncate-rate", type=float, default=0.0, help="pdfを途中で切断する割合"
+    )
+    parser.add_argument("--pdf-size", type=int, help="pdfのサイズ（バイト、末尾を埋める）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--port", type=int, default=0, help="待ち受けるポート")
+
+
+def from_args(args: argparse.Namespace) -> MockSite:
+    """引数からMockSiteを作成"""
+    return MockSite(
+        reports=args.reports,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        truncate_rate=args.truncate_rate,
+        pdf_size=args.pdf_size,
+        seed=args.seed,
+        port=args.port,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PCAOBサイトのモックサーバー")
+    add_arguments(parser)
+    args = parser.parse_args()
+    site = from_args(args)
+    print("Serving on", site.base_url, f"({len(site.reports)} reports)")
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""read_pdf / parse_pdf のオフラインベンチマークと回帰テスト
+
+fixtures/pdf の合成pdfと fixtures/cases の抽出テキストのサンプルについて、
+文書ごとの抽出時間・パース時間・ピークメモリ（Pythonヒープ）と、
+fixtures/golden の正解データに対する項目単位の正解率を表示する。
+正解率が100%でない文書があれば終了コード1を返す。
+
+python -m benchmarks.parser_bench [--repeat 5] [--json result.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import fitz
+
+from backend.scraper.utils import parse_pdf, read_pdf
+from benchmarks.make_fixtures import GOLDEN_DIR, PDF_DIR, case_names, case_text
+
+FIELDS = [
+    "issuer",
+    "industry",
+    "type_of_audit_and_related_area_affected",
+    "description_of_the_deficiencies_identified",
+]
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[Any, float, float]:
+    """実行時間（最小値）とピークメモリを計測
+    Args:
+        func(Callable): 計測する処理
+        repeat(int): 繰り返し回数
+    Returns:
+        result(Any): funcの戻り値
+        seconds(float): 実行時間の最小値（秒）
+        peak_kb(float): Pythonヒープのピーク（KB）
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, best, peak / 1024
+
+
+def accuracy(records: List[Dict[str, Any]], golden: List[Dict[str, Any]]) -> float:
+    """項目単位の正解率（余分なIssuerも不正解として数える）"""
+    predicted = {record["issuer"]: record for record in records}
+    expected = {record["issuer"]: record for record in golden}
+
+    total = len(FIELDS) * len(set(predicted) | set(expected))
+    if total == 0:
+        return 1.0
+
+    correct = 0
+    for issuer, record in expected.items():
+        if issuer in predicted:
+            correct += sum(predicted[issuer][f] == record[f] for f in FIELDS)
+
+    return correct / total
+
+
+def to_records(details: Optional[Any]) -> List[Dict[str, Any]]:
+    """parse_pdfの戻り値をdictのリストに"""
+    return [] if details is None else details.to_dict("records")
+
+
+def bench_case(name: str, repeat: int) -> Dict[str, Any]:
+    """1文書分のベンチマーク"""
+    with open(os.path.join(GOLDEN_DIR, name + ".json"), encoding="utf-8") as f:
+        golden = json.load(f)
+
+    row = SimpleNamespace(file_name=name + ".pdf")
+    file_path = os.path.join(PDF_DIR, name + ".pdf")
+    with fitz.open(file_path) as doc:
+        pages = doc.page_count
+
+    text, extract_s, extract_kb = measure(lambda: read_pdf(file_path), repeat)
+    _, extract_full_s, extract_full_kb = measure(
+        lambda: read_pdf(file_path, targeted=False), repeat
+    )
+    details, parse_s, parse_kb = measure(lambda: parse_pdf(row, text), repeat)
+
+    # pdfを通さないテキストのサンプル
+    sample = case_text(name)
+    sample_details, sample_parse_s, _ = measure(lambda: parse_pdf(row, sample), repeat)
+
+    return {
+        "name": name,
+        "pages": pages,
+        "extract_ms": extract_s * 1000,
+        "extract_full_ms": extract_full_s * 1000,
+        "parse_ms": parse_s * 1000,
+        "sample_parse_ms": sample_parse_s * 1000,
+        "peak_kb": max(extract_kb, parse_kb),
+        "peak_full_kb": extract_full_kb,
+        "issuers": len(golden),
+        "accuracy": accuracy(to_records(details), golden),
+        "sample_accuracy": accuracy(to_records(sample_details), golden),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="read_pdf / parse_pdf のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の繰り返し回数")
+    parser.add_argument("--json", help="結果をjsonで保存するパス")
+    args = parser.parse_args()
+
+    # read_pdfの進捗表示を抑制
+    results = []
+    with open(os.devnull, "w") as devnull:
+        for name in case_names():
+            with redirect_stdout(devnull):
+                results.append(bench_case(name, args.repeat))
+
+    header = (
+        f"{'name':<24}{'pages':>6}{'extract':>10}{'full':>10}{'parse':>9}"
+        + f"{'peak_kb':>10}{'issuers':>8}{'acc':>7}{'text_acc':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['name']:<24}{r['pages']:>6}{r['extract_ms']:>8.2f}ms"
+            + f"{r['extract_full_ms']:>8.2f}ms{r['parse_ms']:>7.2f}ms"
+            + f"{r['peak_kb']:>10.1f}{r['issuers']:>8}"
+            + f"{r['accuracy']:>7.0%}{r['sample_accuracy']:>9.0%}"
+        )
+    print("-" * len(header))
+    print(
+        f"{'total':<24}{sum(r['pages'] for r in results):>6}"
+        + f"{sum(r['extract_ms'] for r in results):>8.2f}ms"
+        + f"{sum(r['extract_full_ms'] for r in results):>8.2f}ms"
+        + f"{sum(r['parse_ms'] for r in results):>7.2f}ms"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [
+        r["name"] for r in results if r["accuracy"] < 1 or r["sample_accuracy"] < 1
+    ]
+    if failed:
+        print("Regression:", failed)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()